@@ -0,0 +1,895 @@
+"""
+稽核核心流程 (不依賴 Streamlit)
+
+Azure OCR、Excel 規則比對、Gemini 雙代理人與本地規則引擎都在這裡，
+app_mobile.py (手機 UI) 與 batch_audit.py (批次 CLI) 共用。
+"""
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import random
+import threading
+import time
+
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
+from azure.ai.documentintelligence import DocumentIntelligenceClient
+from azure.ai.documentintelligence.models import AnalyzeResult
+from PIL import Image, ImageOps
+import google.generativeai as genai
+
+from disk_cache import DiskCache, content_key
+from rule_index import load_rule_index, rules_version
+from table_parser import parse_pages
+from local_engineer import run_engineer_checks
+from local_accountant import run_accountant_checks
+from prompt_compact import build_job_ir, build_raw_input, serialize_for_agent, estimate_tokens
+from incremental import plan_delta, filter_extracted_data, merge_issues, remap_result, build_audit_state
+from page_dedup import image_hash, find_duplicates, find_candidates
+from engineer_shards import SHARD_MAX_IDS, plan_shards, build_shard_jobs, reduce_shard_results
+from stream_json import IssueStreamParser
+from tracing import span, set_attributes, bind
+from model_routing import (
+    MODEL_AUTO, MODEL_FLASH, MODEL_PRO, model_label, escalation_reasons, escalation_data,
+    subset_local_result, merge_routed, record_pro_latency, estimate_pro_latency,
+)
+
+# 規則檔與快取以模組所在目錄為準 (不受目前工作目錄影響)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Excel 規則讀取函數 (索引版：mtime 變動才重建，全文單次掃描比對) ---
+def get_dynamic_rules(ocr_text):
+    with span("rule_match", chars=len(ocr_text or "")) as s:
+        rules = _match_dynamic_rules(ocr_text)
+        s.set(rule_chars=len(rules))
+        return rules
+
+def _match_dynamic_rules(ocr_text):
+    try:
+        # 1. 取得編譯好的規則索引 (rules.xlsx 有更新才會重新讀取)
+        index = load_rule_index()
+        
+        # 2. 對「乾淨版」OCR 全文 (移除所有空格、換行) 做一次多關鍵字比對
+        # 這樣就算 Azure 讀成 "W3 \n #6"，我們也能對得到 "W3#6"
+        # 【關鍵】同時傳遞 Category 給 AI，讓它知道要用哪條邏輯
+        matched_rules = index.match(ocr_text)
+        
+        if not matched_rules: 
+            return "無特定對應規則，請依通用邏輯判斷。"
+            
+        return "\n".join(matched_rules)
+
+    except FileNotFoundError:
+        return "⚠️ 未檢測到 rules.xlsx 規則檔 (請確認檔案是否上傳至 GitHub)。"
+    except Exception as e:
+        return f"讀取規則檔時發生錯誤: {e}"
+
+# --- 4. 核心函數：Azure 神之眼 ---
+OCR_MODEL_ID = "prebuilt-layout"
+
+# DocumentIntelligenceClient 可跨執行緒共用，依 (endpoint, key) 只建一次 (沿用連線池)
+_doc_clients = {}
+_client_lock = threading.Lock()
+
+def get_doc_client(endpoint, key):
+    with _client_lock:
+        client = _doc_clients.get((endpoint, key))
+        if client is None:
+            client = _doc_clients[(endpoint, key)] = DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))
+    return client
+
+def _tables_to_markdown(tables, page_num=None):
+    # page_num=None 時頁碼取自 bounding_regions；拆分多頁結果時固定填單頁送出時的頁碼
+    markdown_output = ""
+    for idx, table in enumerate(tables):
+        table_page = page_num
+        if table_page is None:
+            table_page = table.bounding_regions[0].page_number if table.bounding_regions else "Unknown"
+        markdown_output += f"\n### Table {idx + 1} (Page {table_page}):\n"
+        rows = {}
+        for cell in table.cells:
+            r, c = cell.row_index, cell.column_index
+            content = cell.content.replace("\n", " ").strip()
+            if r not in rows: rows[r] = {}
+            rows[r][c] = content
+        for r in sorted(rows.keys()):
+            row_cells = []
+            if rows[r]:
+                max_col = max(rows[r].keys())
+                for c in range(max_col + 1): row_cells.append(rows[r].get(c, ""))
+                markdown_output += "| " + " | ".join(row_cells) + " |\n"
+    return markdown_output
+
+def extract_layout_with_azure(file_obj, endpoint, key):
+    client = get_doc_client(endpoint, key)
+    file_content = file_obj.getvalue()
+    poller = client.begin_analyze_document(OCR_MODEL_ID, file_content, content_type="application/octet-stream")
+    result: AnalyzeResult = poller.result()
+    
+    markdown_output = _tables_to_markdown(result.tables or [])
+    header_snippet = result.content[:800] if result.content else ""
+    # 回傳全文以供規則比對
+    return markdown_output, header_snippet, result.content
+
+# --- 4.0 整份工令合併成單一 PDF 送出 (一次請求取代 N 次，結果再依頁拆回) ---
+# Azure 限制：PDF 單頁不可超過 17 x 17 英寸；檔案大小上限依定價層而定 (F0 為 4MB)
+BUNDLE_MAX_PAGES = int(os.environ.get("OCR_BUNDLE_MAX_PAGES", "100"))
+BUNDLE_MAX_MB = float(os.environ.get("OCR_BUNDLE_MAX_MB", "50"))
+BUNDLE_MAX_INCHES = 17
+BUNDLE_MIN_DPI = 200
+
+PDF_COLOR_SPACES = {"RGB": "/DeviceRGB", "L": "/DeviceGray"}
+
+def _bundle_jpeg(file_bytes):
+    """回傳 (JPEG bytes, 寬, 高, 色彩模式)；JPEG 原檔直接沿用，其他格式/需要轉向的才重新壓縮"""
+    image = Image.open(io.BytesIO(file_bytes))
+    if image.format == "JPEG" and image.mode in PDF_COLOR_SPACES and image.getexif().get(0x0112, 1) == 1:
+        return file_bytes, image.width, image.height, image.mode
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L" if image.mode in ("L", "LA", "1") else "RGB")
+    converted = io.BytesIO()
+    image.save(converted, "JPEG", quality=95)
+    return converted.getvalue(), image.width, image.height, image.mode
+
+def build_pdf_bundle(page_bytes_list):
+    """
+    把多張頁面圖片組成一份多頁 PDF (記憶體內)。
+    JPEG 以 DCTDecode 原樣嵌入 (不解碼、不重新壓縮，OCR 看到的畫質與逐頁送出相同)；
+    Pillow 的 PDF 輸出一律重新壓縮，所以這裡自己寫最小的 PDF 結構。
+    """
+    jpegs = [_bundle_jpeg(b) for b in page_bytes_list]
+    # 解析度設定到讓最大邊不超過 17 英寸 (像素不變，只影響 PDF 頁面尺寸)
+    dpi = max(BUNDLE_MIN_DPI, max(max(w, h) for _, w, h, _ in jpegs) / BUNDLE_MAX_INCHES)
+    n = len(jpegs)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (3 + 3 * k) for k in range(n)) + b"] /Count %d >>" % n]
+    for k, (data, w, h, mode) in enumerate(jpegs):
+        pw, ph = w * 72 / dpi, h * 72 / dpi
+        draw = b"q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q" % (pw, ph)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+                       % (pw, ph, 4 + 3 * k, 5 + 3 * k))
+        objects.append(b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n"
+                       % (w, h, PDF_COLOR_SPACES[mode].encode(), len(data)) + data + b"\nendstream")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(draw) + draw + b"\nendstream")
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    output.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
+
+def split_analyze_result(result, page_count):
+    """
+    多頁 AnalyzeResult 依頁拆回 [(table_md, header_snippet, full_content), ...]，
+    格式與逐頁送出相同 (表格依 bounding_regions 頁碼分配，全文依 pages[].spans 切出)。
+    """
+    pages = result.pages or []
+    if len(pages) != page_count:
+        raise ValueError(f"合併送出 {page_count} 頁，Azure 回傳 {len(pages)} 頁")
+    tables_by_page = {}
+    for table in result.tables or []:
+        if not table.bounding_regions:
+            raise ValueError("表格缺少頁碼，無法拆分")
+        tables_by_page.setdefault(table.bounding_regions[0].page_number, []).append(table)
+
+    content = result.content or ""
+    outputs = []
+    for page in sorted(pages, key=lambda p: p.page_number):
+        page_content = "\n".join(content[s.offset:s.offset + s.length] for s in page.spans or [])
+        # 每頁都當成單頁文件的第 1 頁，與逐頁送出 (及 OCR 快取) 的結果一致
+        table_md = _tables_to_markdown(tables_by_page.get(page.page_number, []), page_num=1)
+        outputs.append((table_md, page_content[:800], page_content))
+    return outputs
+
+def extract_bundle_with_azure(bundle_bytes, page_count, endpoint, key):
+    client = get_doc_client(endpoint, key)
+    poller = client.begin_analyze_document(OCR_MODEL_ID, bundle_bytes, content_type="application/pdf")
+    result: AnalyzeResult = poller.result()
+    return split_analyze_result(result, page_count)
+
+# --- 4.1 並行 OCR：有界執行緒池 + 429 退避重試 ---
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 跨行程的 Azure / Gemini 並行上限 (批次模式由 batch_audit 設定；UI 由 job_queue 的 worker pool 設定)
+_ocr_limit = contextlib.nullcontext()
+_llm_limit = contextlib.nullcontext()
+
+def set_concurrency_limits(ocr_limit=None, llm_limit=None):
+    """ocr_limit / llm_limit：任何支援 with 的號誌 (例如 multiprocessing.Manager().BoundedSemaphore)"""
+    global _ocr_limit, _llm_limit
+    _ocr_limit = ocr_limit if ocr_limit is not None else contextlib.nullcontext()
+    _llm_limit = llm_limit if llm_limit is not None else contextlib.nullcontext()
+
+def _retry_after_seconds(err):
+    # Azure 限流時會帶 Retry-After (秒數)，沒有就回傳 None 改用指數退避
+    response = getattr(err, "response", None)
+    if response is None: return None
+    try:
+        value = response.headers.get("Retry-After") or response.headers.get("retry-after")
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def _call_azure_with_retry(func, *args, max_retries=5, base_delay=1.0, max_delay=30.0):
+    for attempt in range(max_retries + 1):
+        try:
+            with _ocr_limit:
+                return func(*args)
+        except HttpResponseError as e:
+            if e.status_code not in RETRYABLE_STATUS or attempt == max_retries:
+                raise
+            set_attributes(retries=attempt + 1, last_status=e.status_code)
+            wait = _retry_after_seconds(e)
+            if wait is None:
+                # Full jitter：避免多個執行緒同時醒來又一起撞到限流
+                wait = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            else:
+                wait = min(max_delay, wait) + random.uniform(0, base_delay)
+            time.sleep(wait)
+
+def extract_layout_with_retry(file_obj, endpoint, key, max_retries=5, base_delay=1.0, max_delay=30.0):
+    return _call_azure_with_retry(extract_layout_with_azure, file_obj, endpoint, key,
+                                  max_retries=max_retries, base_delay=base_delay, max_delay=max_delay)
+
+def _run_bundle(pages, endpoint, key):
+    """整批合併送出；超過頁數/大小上限、圖片無法組成 PDF 或拆分失敗時回傳 None (改逐頁送出)"""
+    if len(pages) < 2 or len(pages) > BUNDLE_MAX_PAGES: return None
+    with span("azure_ocr.bundle", pages=len(pages)) as s:
+        try:
+            bundle = build_pdf_bundle([f.getvalue() for _, f in pages])
+            s.set(bytes=len(bundle))
+            if len(bundle) > BUNDLE_MAX_MB * 1024 * 1024:
+                s.set(fallback="too_large")
+                return None
+            return _call_azure_with_retry(extract_bundle_with_azure, bundle, len(pages), endpoint, key)
+        except Exception as e:
+            s.set(fallback=f"{type(e).__name__}: {e}")
+            return None
+
+def _ocr_page(idx, file_obj, endpoint, key):
+    with span("azure_ocr.page", page=idx + 1, bytes=len(file_obj.getvalue())):
+        return extract_layout_with_retry(file_obj, endpoint, key)
+
+def run_ocr_stage(pages, endpoint, key, max_workers=4, on_page_done=None, bundle=False):
+    """
+    pages: [(頁面索引, file_obj), ...] (只放需要掃描的頁面)
+    回傳 {頁面索引: (table_md, header_snippet, full_content) 或 Exception}
+    on_page_done(頁面索引, 結果) 會在「主執行緒」依完成順序呼叫，方便更新進度條。
+    bundle=True 時先嘗試整批合併成一份 PDF 送出，失敗才退回逐頁並行。
+    """
+    results = {}
+    if not pages: return results
+    if bundle:
+        outputs = _run_bundle(pages, endpoint, key)
+        if outputs is not None:
+            for (idx, _), output in zip(pages, outputs):
+                results[idx] = output
+                if on_page_done: on_page_done(idx, output)
+            return results
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        future_to_idx = {executor.submit(bind(_ocr_page), idx, f, endpoint, key): idx for idx, f in pages}
+        for future in concurrent.futures.as_completed(future_to_idx):
+            idx = future_to_idx[future]
+            try:
+                results[idx] = future.result()
+            except Exception as e:
+                results[idx] = e
+            if on_page_done: on_page_done(idx, results[idx])
+    return results
+
+# --- 4.2 持久化 OCR 快取 (跨 session / 重啟共用，以圖片內容雜湊定址) ---
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", os.path.join(BASE_DIR, ".ocr_cache"))
+OCR_CACHE_MAX_MB = int(os.environ.get("OCR_CACHE_MAX_MB", "500"))
+
+_ocr_cache = None
+_llm_cache = None
+_cache_lock = threading.Lock()
+
+def get_ocr_cache():
+    # 行程內共用一個實例 (所有 Streamlit session / 批次執行緒)
+    global _ocr_cache
+    with _cache_lock:
+        if _ocr_cache is None: _ocr_cache = DiskCache(OCR_CACHE_DIR, max_bytes=OCR_CACHE_MAX_MB * 1024 * 1024)
+    return _ocr_cache
+
+def ocr_cache_key(file_bytes):
+    return content_key(OCR_MODEL_ID, file_bytes)
+
+# --- 5.0 Gemini 呼叫 + 回應快取 (temperature 固定 0.0，相同輸入直接回傳上次結果) ---
+# 穩定參數
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "temperature": 0.0,
+}
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", os.path.join(BASE_DIR, ".llm_cache"))
+LLM_CACHE_TTL_HOURS = float(os.environ.get("LLM_CACHE_TTL_HOURS", "72"))
+LLM_CACHE_MAX_MB = int(os.environ.get("LLM_CACHE_MAX_MB", "100"))
+
+def get_llm_cache():
+    global _llm_cache
+    with _cache_lock:
+        if _llm_cache is None: _llm_cache = DiskCache(LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024, ttl=LLM_CACHE_TTL_HOURS * 3600)
+    return _llm_cache
+
+def is_valid_agent_result(result):
+    return isinstance(result, dict) and isinstance(result.get("issues"), list)
+
+def _chunk_text(chunk):
+    # 串流最後一塊可能只有 finish_reason 沒有文字，.text 會丟 ValueError
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+def _usage_tokens(response):
+    # 真實 SDK 回傳 usage_metadata (串流時在最後一塊)；沒有就回傳 None 改用估計值
+    usage = getattr(response, "usage_metadata", None)
+    prompt = getattr(usage, "prompt_token_count", None)
+    return (prompt, getattr(usage, "candidates_token_count", None)) if prompt else None
+
+def call_gemini_json(model_name, system_prompt, combined_input, matched_rules="", on_issue=None):
+    """
+    回傳解析後的 JSON (dict)；失敗回傳 None。
+    只有格式正確的結果才寫入快取，失敗的 fallback 絕不當成「全數合格」存起來。
+    on_issue: 有給時改用串流生成，issues[] 每完成一筆就呼叫 on_issue(issue) (快取命中時一次送出全部)
+    """
+    with span("gemini", model=model_name, stream=on_issue is not None) as s:
+        cache = get_llm_cache()
+        cache_key = content_key(model_name, json.dumps(GENERATION_CONFIG, sort_keys=True), system_prompt, matched_rules, combined_input)
+        cached = cache.get(cache_key)
+        s.set(cache_hit=cached is not None)
+        if cached is not None:
+            if on_issue:
+                for issue in cached["issues"]: on_issue(issue)
+            return dict(cached, _from_cache=True)
+
+        model = genai.GenerativeModel(model_name)
+        usage = None
+        try:
+            t_wait = time.time()
+            with _llm_limit:
+                s.set(queue_wait_ms=round((time.time() - t_wait) * 1000, 1))
+                t_call = time.time()
+                if on_issue is None:
+                    response = model.generate_content([system_prompt, combined_input], generation_config=GENERATION_CONFIG)
+                    text = response.text
+                    usage = _usage_tokens(response)
+                else:
+                    parser = IssueStreamParser()
+                    for chunk in model.generate_content([system_prompt, combined_input], generation_config=GENERATION_CONFIG, stream=True):
+                        if not parser.text: s.set(first_chunk_ms=round((time.time() - t_call) * 1000, 1))
+                        for issue in parser.feed(_chunk_text(chunk)): on_issue(issue)
+                        usage = _usage_tokens(chunk) or usage
+                    text = parser.text
+            prompt_tokens, response_tokens = usage or (estimate_tokens(system_prompt) + estimate_tokens(combined_input), estimate_tokens(text))
+            s.set(prompt_tokens=prompt_tokens, response_tokens=response_tokens, tokens_estimated=usage is None)
+            result = json.loads(text)
+        except:
+            s.set(failed=True)
+            return None
+        if not is_valid_agent_result(result):
+            s.set(failed=True)
+            return None
+        s.set(issues=len(result["issues"]))
+        cache.set(cache_key, result)
+        return result
+
+# --- 5.1 Agent A: 工程師 (動態規則版) ---
+ENGINEER_INTERLOCK_RULES = """
+    #### A. 流程防呆 (Interlock) - 【邏輯修正】：
+    - **流程順序**：未再生 -> 銲補 -> 再生車修 -> 研磨。
+    - **完工定義**：
+      - **已完工**：本體未再生實測值為「小數」(有小數點) -> **不可出現** 在後續任何流程。
+      - **未完工**：本體未再生實測值為「整數」 -> **必須進入** 後續的「銲補」與「再生車修」流程。
+    - **異常判定**：
+      1. 若「已完工」卻出現在後續 -> **FAIL (流程異常：已完工件重複加工)**。
+      2. 若「未完工(整數)」卻 **沒有** 出現在「銲補」或「再生」 -> **FAIL (流程異常：未完工件中斷)**。
+    - **後向溯源**：若編號出現在「銲補」、「再生」或「研磨」，則 **必須存在** 於該部位的「未再生」紀錄中 (防止幽靈工件)。
+    - **存在性依賴**：若編號出現在軸頸/Keyway/內孔，但本體完全沒出現 -> **FAIL (幽靈工件)**。
+    - **Keyway/內孔依賴**：必須有「軸位再生」才能做。
+
+    #### B. 尺寸邏輯檢查 (Size Ordering) - 【嚴格執行】：
+    - **核心原則**：針對同一編號，依據製程物理特性，尺寸大小必須符合以下順序：
+      **`未再生 (Pre-repair) < 研磨 (Grinding) < 再生車修 (Finish) < 銲補 (Welding)`**
+    - **詳細驗證規則** (若該階段有數據)：
+      1. **未再生車修**：必須是該編號所有流程中的 **最小值**。
+      2. **銲補**：必須是該編號所有流程中的 **最大值**。
+      3. **研磨 vs 再生**：若兩者皆存在，**研磨 必須小於 再生車修**。
+    - **異常判定**：若違反上述任何大小關係 (例如：未再生 > 再生，或 研磨 > 銲補) -> **FAIL (尺寸邏輯異常：違反製程大小順序)**。
+"""
+
+def build_interlock_section(local_result):
+    # 沒有本地引擎結果：照舊讓 Gemini 執行完整的 A/B 檢查
+    if local_result is None: return ENGINEER_INTERLOCK_RULES
+    section = """
+    #### A/B. 流程防呆與尺寸邏輯 -【已由本地規則引擎完成】：
+    - 已解析的滾輪編號已在本地完成「流程防呆」、「尺寸順序」與「幽靈工件」檢查，**請勿重複回報** 這三類問題。
+    """
+    if not local_result["residual"]: return section
+    residual = "\n".join(f"    - {line}" for line in local_result["residual"])
+    return section + f"""- **僅針對** 以下本地無法確定歸屬的資料，套用下方 A/B 規則：
+{residual}
+""" + ENGINEER_INTERLOCK_RULES
+
+def agent_engineer_check(combined_input, full_text_for_search, api_key, model_name, local_result=None, on_issue=None):
+    genai.configure(api_key=api_key)
+    
+    # 1. 先去 Excel 撈規則
+    dynamic_rules = get_dynamic_rules(full_text_for_search)
+    interlock_section = build_interlock_section(local_result)
+
+    system_prompt = f"""
+    你是一位極度嚴謹的中鋼機械品管【工程師】。
+    
+    ### 📂 專案特定規範 (Project Specs from Excel)：
+    **以下是根據文件內容自動檢索到的標準答案，優先級最高：**
+    {dynamic_rules}
+    --------------------------------------------------
+    任務：專注於「數據規格」、「製程邏輯」與「尺寸合理性」。
+    
+    ### ⛔️ 極重要原則 (Strict Rules)：
+    1. **合格即PASS**：只要實測值落在規格區間內 (包含邊界值)，就是 **PASS**。
+    2. **禁止雞婆**：絕對 **不要** 回報「接近上限」、「裕度不足」、「剛好達標」等主觀意見。這會干擾判斷。
+    3. **排除無關項目**：不檢查數量、不檢查表頭、不檢查簽名。
+
+    ### 0. 核心任務與數據前處理：
+    - **識別滾輪編號 (Roll ID)**：找出每筆數據對應的編號 (如 `Y5612001`, `E30`)。
+    - **分軌識別**：區分該項目屬於「本體 (Body)」還是「軸頸 (Journal)」。
+    - **數值容錯**：忽略數字間的空格 (如 `341 . 12` -> `341.12`)。
+
+    ### 1. 核心邏輯 (Process & Dimension)：
+    **請建立每一支滾輪編號 (Roll ID) 的完整履歷，並執行以下比對：**
+    
+    #### ⚠️ 獨立項目豁免 (Standalone Exemption) - 【優先排除】：
+    - **定義**：以下項目屬於獨立加工，**不參與** 下方的「流程防呆(A)」與「尺寸邏輯檢查(B)」：
+      1. **組裝/拆裝** (包含新品組裝、舊品拆裝、真圓度測試)。
+      2. **鍵槽 (Keyway)**。
+      3. **內孔 (Inner Hole)**。
+    - **規則**：針對上述項目，請 **僅執行** 「第 2 點：製程判定邏輯 (單項規格檢查)」，**忽略** 跨流程的前後對照。
+
+{interlock_section}
+    ### 2. 製程判定邏輯 (分軌制)：
+    **數值容錯**：忽略數字間的空格 (如 `341 . 12` -> `341.12`)。
+
+    #### A. 【本體 (Body)】未再生/車修：
+    - **規格**：忽略「每次車修」，只看「至 Ymm」。多規格取 **最大值 (Max_Spec)**。
+    - **邏輯**：整數(未完工) <= Max_Spec；小數(已完工) >= Max_Spec 且格式 `#.##`。
+
+    #### B. 【軸頸 (Journal)】未再生/車修：
+    - **規格**：採「智慧歸類」，比對最接近的規格。
+    - **邏輯**：實測 <= 目標規格。
+    - **格式**：必須為 **整數**。出現小數 -> **FAIL**。
+
+    #### C. 銲補 (Welding) - 【加法邏輯】：
+    - **邏輯防呆**：銲補是加肉，數值越大越好。
+    - **規則**：實測值 **>=** 規格。嚴禁使用未再生的<=邏輯。
+
+    #### D. 再生車修 (Finish) / E. 內孔 (Inner Hole)：
+    - **多重規格**：符合任一規格區間即 PASS。
+    - **內孔對應**：軸頸~85 -> 孔50；軸頸~75 -> 孔45。
+    - **數值**：**包含於 (Inclusive)** 上下限之間。 `Min <= X <= Max` 均為合格。
+    - **格式**：精確到小數點後兩位。
+
+    #### F. 組裝/拆裝 (Assembly) - 【真圓度檢查】：
+    - **適用項目**：項目名稱包含「舊品拆裝」或「新品組裝」者。
+    - **規格識別**：尋找「真圓度」規範 (例如：真圓度 ±0.1mm)。
+    - **數值邏輯**：真圓度數值必須 **<=** 規範上限 (取絕對值，例如 0.1)。
+    - **格式規定**：
+      - 實測值必須精確到 **小數點後兩位 (`#.##`)**。
+      - 範例：`0.03` -> **PASS**；`0.1` -> **FAIL (位數不足)**；`0.0` -> **FAIL (位數不足)**。
+
+    ### 輸出格式 (JSON Only) - 【請極度簡潔，節省成本】：
+    - **common_reason**: 限制在 **15個中文字以內**。例如 "數值超規"、"流程異常"。**禁止** 在此欄位解釋計算過程。
+    - **spec_logic**: 僅寫出標準即可，例如 ">= 233"。
+    - **Excel 標記**：若該項目的判定標準是來自最上方的 **「專案特定規範 (Project Specs)」**，請務必在 `item` 名稱最後面加上 `(📚Excel)` 以供識別。
+    {{
+      "issues": [
+         {{
+           "page": "頁碼",
+           "item": "項目名稱 (若來自Excel請加註標記)",
+           "issue_type": "數值超規 / 流程異常 / 尺寸異常 / 格式錯誤 / 依賴異常",
+           "spec_logic": "判定標準",
+           "common_reason": "簡短錯誤原因(限15字)",
+           "failures": [{{ "id": "ID", "val": "Value", "calc": "計算式(若有)" }}]
+         }}
+      ]
+    }}
+    """
+    
+    result = call_gemini_json(model_name, system_prompt, combined_input, dynamic_rules, on_issue)
+    return result if result is not None else {"issues": [], "_failed": True}
+
+# --- 5.1.1 工程師分片稽核：依滾輪編號切片、平行呼叫後合併 (大型工令) ---
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", "8"))
+
+def agent_engineer_check_sharded(extracted_data_list, parsed_pages, full_text_for_search, api_key, model_name,
+                                 local_result=None, token_budget=None, max_ids=SHARD_MAX_IDS, max_workers=SHARD_WORKERS, on_issue=None):
+    """
+    編號數不超過 max_ids 時與 agent_engineer_check 相同 (單次呼叫)；
+    否則每片各自精簡序列化後平行呼叫 (同時最多 max_workers 片，另受全域 Gemini 上限約束)。
+    回傳格式同 agent_engineer_check，另加 "shards" (分片數)。
+    on_issue 會從多個執行緒被呼叫 (各片串流到的問題直接送出，不等合併)。
+    """
+    shards = plan_shards(parsed_pages, max_ids) if max_ids else []
+    if len(shards) <= 1:
+        combined_input, _ = serialize_for_agent(build_job_ir(extracted_data_list), "engineer", token_budget)
+        return agent_engineer_check(combined_input, full_text_for_search, api_key, model_name, local_result, on_issue)
+
+    def run_shard(n, job):
+        data, shard_local = job
+        with span("engineer.shard", shard=n, roll_ids=len(shards[n]), pages=len(data)):
+            shard_input, _ = serialize_for_agent(build_job_ir(data), "engineer", token_budget)
+            return agent_engineer_check(shard_input, full_text_for_search, api_key, model_name, shard_local, on_issue)
+
+    jobs = build_shard_jobs(extracted_data_list, parsed_pages, local_result, shards)
+    set_attributes(shards=len(jobs))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as executor:
+        results = list(executor.map(bind(run_shard), range(len(jobs)), jobs))  # map 保持分片順序
+    merged = dict(reduce_shard_results(results), shards=len(jobs))
+    if all(r.get("_from_cache") for r in results): merged["_from_cache"] = True
+    if any(r.get("_failed") for r in results): merged["_failed"] = True
+    return merged
+
+# --- 5.2 Agent B: 會計師 (運費規則版) ---
+def build_accountant_local_section(local_result):
+    if local_result is None: return ""
+    residual = "\n".join(f"    - {line}" for line in local_result["residual"])
+    return f"""
+    ### ✅ 本地對帳引擎已完成 (請勿重複回報)：
+    - 已解析的表格已在本地完成表頭一致性、單位換算數量、編號重複、Keyway、運費與聚合統計核對。
+    - **僅針對** 以下本地無法解析的資料，執行下方規則：
+{residual}
+    """
+
+def agent_accountant_check(combined_input, full_text_for_search, api_key, model_name, local_result=None, on_issue=None):
+    genai.configure(api_key=api_key)
+    
+    system_prompt = """
+    你是一位極度嚴謹的中鋼機械品管【會計師】。
+
+    ### 📂 專案特定規範 (Project Rules)：
+    **請優先參考以下規則中的數量單位定義 (Unit_Rule)：**
+    {dynamic_rules}
+    -------------------------------------------------
+    {local_section}
+    任務：專注於「數量核對」、「表頭一致性」與「上方統計表格」。
+    **請完全忽略** 尺寸公差與製程邏輯。
+
+    ### ⛔️ 排除指令：
+    - 不檢查尺寸是否超規。
+    - 不檢查流程先後順序。
+    - 不檢查簽名。
+
+    ### 1. 跨頁一致性 (Header)：
+    - 工令編號、交貨日期(預定/實際)：所有頁面必須相同。日期格式 `YYY.MM.DD` (允許空格)。
+
+    ### 2. 數量一致性檢查 (Quantity)：
+    - **單位換算**：`(1SET=4PCS)` -> *4；`(SET)` -> *2；`(PC)` -> *1。
+    - **熱處理**：忽略數量，有數據即 PASS。
+    - **本體 (Body)**：
+      - **唯一性定義**：檢查範圍僅限於 **「單一項目內」**。
+      - 規則：在同一個項目(如本體未再生)中，編號不可重複。
+      - **注意**：同一編號出現在不同項目(如P2未再生、P3銲補)是正常流程，**不算** 重複。
+      - 數量：該項目內的獨立編號總數 = 目標數量。
+    - **軸頸 (Journal) / 內孔**：允許單一編號出現 2 次。
+      - 判定：**資料總筆數 (Total Row Count)** = 目標數量。
+    - **Keyway**：Keyway 數量 <= 軸位再生數量。
+
+    ### 3. 上方統計欄位稽核 (Summary Table Reconciliation) - 【邏輯修正】：
+    **請核對左上角「統計表格」的「實交數量」與內文計數：**
+    - **重要前提**：上方統計表格的數值代表 **「全卷總數」**。若在每一頁重複出現，**請勿累加**，取單一值即可。
+    
+    - **A. 運費規則 (Freight) - 【邏輯修正】：**
+      - 適用項目：名稱包含「運費」者 (如「輥輪拆裝.車修或銲補運費」)。
+      - **計數來源**：僅計算全卷 **「本體未再生車修」** 的項目數量。
+      - **運費專用計數邏輯 (Freight Counting Logic)**：
+        - **特例 (Exception)**：若項目名稱包含 `W3 #1~6號機 130~145 ROLL ROLL BODY車修加工`，該項目的 `1 SET` 在運費計算中視為 **1 個單位 (x1)**。
+        - **情境 1**：若項目名稱包含 `(1SET=4PCS)` 關鍵字，該項目的 `1 SET` 在運費計算中視為 **1 個單位 (x1)**。
+        - **情境 2**：若項目名稱僅標示 `(SET)` 且無上述特殊定義，該項目的 `1 SET` 在運費計算中視為 **2 個單位 (x2)**。
+        - **情境 3**：若標示 `(PC)`，則直接累加數量。
+      - **檢查**：統計欄位的數值 必須等於 上述邏輯計算出的總和。
+    - **B. 雙軌聚合 (Aggregated)**：
+      - 項目：含「ROLL 車修」、「ROLL 銲補」、「ROLL 拆裝」。
+      - 車修總數 = 全卷 (本體未再生 + 本體再生 + 軸頸未再生 + 軸頸再生) 總和。
+      - 銲補總數 = 全卷 (本體銲補 + 軸頸銲補) 總和。
+      - 拆裝總數 = 全卷 (新品組裝 + 舊品拆裝) 總和。
+    - **C. 通用規則**：其他項目 (如水管拆除) -> 統計數 = 下方列表數。
+    - **D. 例外**：**W3 #6 機 驅動輥輪** 不列入聚合，採通用規則獨立核對。
+    
+    - **判定**：若 統計數量(單一值) != 計算出的總和 -> **FAIL**。
+
+    ### 4. 執行步驟 (Step-by-Step Execution) - 【強制點名，不回傳】：
+    為了確保數量準確，在判斷數量是否異常前，請執行以下內心思考 (不要輸出到 JSON)：
+    1. **Extraction (提取)**：找出該項目所有相關的實測編號。
+    2. **Counting (計數)**：計算這些編號的數量。
+    3. **Comparison (比對)**：與目標數量比對。
+    4. **Reporting (回報)**：只有當兩者不符時，才生成 Error。
+
+    ### 輸出格式 (JSON Only) - 【請極度簡潔，節省成本】：
+    - **common_reason**: 限制在 **15個中文字以內**。例如 "統計數量不符"、"數量不符"。**禁止** 在此欄位解釋計算過程。
+    - **calc**: 在此欄位顯示簡單算式即可，例如 "統計32 != 計算26"。
+    {
+      "job_no": "工令編號",
+      "issues": [
+         {
+           "page": "頁碼",
+           "item": "項目名稱",
+           "issue_type": "數量不符 / 統計數量不符 / 跨頁資訊不符 / 編號重複",
+           "spec_logic": "判定標準",
+           "common_reason": "簡短錯誤原因(限15字)",
+           "failures": [{"id": "ID", "val": "Count", "calc": "統計X != 計算Y"}]
+         }
+      ]
+    }
+    """
+    # system_prompt 不是 f-string (JSON 範例有大括號)，用 replace 填入本地對帳結果
+    system_prompt = system_prompt.replace("{local_section}", build_accountant_local_section(local_result))
+    
+    result = call_gemini_json(model_name, system_prompt, combined_input, on_issue=on_issue)
+    return result if result is not None else {"job_no": "Error", "issues": [], "_failed": True}
+
+
+# --- 5.3 自動模型路由 (auto：Flash 先跑，受影響項目才交給 Pro 複核) ---
+def _model_tagger(on_issue, model_name):
+    if on_issue is None: return None
+    return lambda issue: on_issue(dict(issue, model=model_label(model_name)))
+
+def run_agent_routed(agent, run, extracted_data_list, parsed_pages, local_result, model_name, token_budget=None, on_issue=None):
+    """
+    run(extracted_data_list, parsed_pages, local_result, model_name, on_issue) -> Agent 結果
+    model_name 不是 auto 時直接呼叫一次。auto 時結果另含 "_routing"：
+    {"flash_time", "pro_time", "escalated": [{"item", "reason"}], "est_pro_time", "saved"}
+    串流送出的問題帶 model 標籤；被 Pro 複核取代的 Flash 問題以最後回傳的結果為準。
+    """
+    if model_name != MODEL_AUTO:
+        return run(extracted_data_list, parsed_pages, local_result, model_name, on_issue)
+
+    t0 = time.time()
+    flash = run(extracted_data_list, parsed_pages, local_result, MODEL_FLASH, _model_tagger(on_issue, MODEL_FLASH))
+    flash_time = time.time() - t0
+    result = dict(flash, issues=[dict(i, model=model_label(MODEL_FLASH)) for i in flash.get("issues", [])])
+
+    if flash.get("_failed"):
+        reasons = {"*": "schema"}
+        data, pages, local = extracted_data_list, parsed_pages, local_result
+    else:
+        reasons = escalation_reasons(flash, agent, parsed_pages, local_result)
+        data = escalation_data(extracted_data_list, parsed_pages, flash.get("issues", []), set(reasons)) or extracted_data_list
+        pages = parse_pages(data)
+        local = subset_local_result(local_result, pages)
+    set_attributes(escalated=len(reasons))
+
+    pro_time = 0.0
+    if reasons:
+        t1 = time.time()
+        pro = run(data, pages, local, MODEL_PRO, _model_tagger(on_issue, MODEL_PRO))
+        pro_time = time.time() - t1
+        if not pro.get("_failed"):
+            if not pro.get("_from_cache"):
+                record_pro_latency(pro_time, serialize_for_agent(build_job_ir(data), agent, token_budget)[1]["tokens"])
+            result = merge_routed(flash, pro, set(reasons), whole="*" in reasons)
+
+    full_tokens = serialize_for_agent(build_job_ir(extracted_data_list), agent, token_budget)[1]["tokens"]
+    est_pro_time = estimate_pro_latency(full_tokens)
+    result["_routing"] = {
+        "flash_time": round(flash_time, 3), "pro_time": round(pro_time, 3),
+        "escalated": [{"item": k, "reason": r} for k, r in reasons.items()],
+        "est_pro_time": round(est_pro_time, 3), "saved": round(est_pro_time - flash_time - pro_time, 3),
+    }
+    return result
+
+def run_engineer_agent(extracted_data_list, parsed_pages, full_text_for_search, api_key, model_name,
+                       local_result=None, token_budget=None, shard_max_ids=SHARD_MAX_IDS, on_issue=None):
+    """工程師 Agent 入口：模型路由 -> 分片 -> agent_engineer_check"""
+    def run(data, pages, local, model, emit):
+        return agent_engineer_check_sharded(data, pages, full_text_for_search, api_key, model, local, token_budget, shard_max_ids, on_issue=emit)
+    return run_agent_routed("engineer", run, extracted_data_list, parsed_pages, local_result, model_name, token_budget, on_issue)
+
+def run_accountant_agent(extracted_data_list, parsed_pages, full_text_for_search, api_key, model_name,
+                         local_result=None, token_budget=None, on_issue=None):
+    """會計師 Agent 入口：模型路由 -> agent_accountant_check"""
+    def run(data, pages, local, model, emit):
+        combined_input, _ = serialize_for_agent(build_job_ir(data), "accountant", token_budget)
+        return agent_accountant_check(combined_input, full_text_for_search, api_key, model, local, emit)
+    return run_agent_routed("accountant", run, extracted_data_list, parsed_pages, local_result, model_name, token_budget, on_issue)
+
+# --- 6. 結果合併 (加上來源標籤) ---
+AGENT_SOURCES = {"engineer": '👷 工程師', "accountant": '👨‍💼 會計師'}
+
+def issue_source(agent, issue, local=False):
+    """來源標籤：本地引擎的結果另外標註；auto 路由另標回答的模型"""
+    if local: return f"{AGENT_SOURCES[agent]} (本地)"
+    return AGENT_SOURCES[agent] + (f" ({issue['model']})" if issue.get('model') else '')
+
+def source_tagger(agent, on_issue):
+    """串流用：把 Agent 送出的單筆問題加上來源標籤後轉給 on_issue"""
+    if on_issue is None: return None
+    return lambda issue: on_issue(dict(issue, source=issue_source(agent, issue)))
+
+def merge_agent_results(local_eng, res_eng, local_acc, res_acc):
+    """回傳 (工令編號, 所有異常)；工令編號以本地解析為準，抓不到才用 Gemini 的"""
+    job_no = local_acc["job_no"] if local_acc["job_no"] != "Unknown" else res_acc.get("job_no", "Unknown")
+    
+    # 幫工程師加標籤
+    issues_eng = res_eng.get("issues", [])
+    for i in issues_eng: i['source'] = issue_source("engineer", i)
+    issues_local = local_eng["issues"]
+    for i in issues_local: i['source'] = issue_source("engineer", i, local=True)
+    
+    # 幫會計師加標籤
+    issues_acc = res_acc.get("issues", [])
+    for i in issues_acc: i['source'] = issue_source("accountant", i)
+    issues_acc_local = local_acc["issues"]
+    for i in issues_acc_local: i['source'] = issue_source("accountant", i, local=True)
+    
+    return job_no, issues_local + issues_eng + issues_acc_local + issues_acc
+
+# --- 7. 整份工令稽核 (批次模式與 UI 背景工作佇列共用) ---
+def audit_job(page_bytes_list, doc_endpoint, doc_key, gemini_key, eng_model_name, acc_model_name, ocr_workers=4, token_budget=None, ocr_bundle=True, skip_duplicates=True, shard_max_ids=SHARD_MAX_IDS, on_issue=None, on_progress=None, prev_audit=None):
+    """
+    page_bytes_list: 依頁序排列的圖片 bytes
+    skip_duplicates: 重複頁 (檔案相同不送 OCR；OCR 全文幾乎相同不進 Prompt)；影像相近只列為疑似重複
+    shard_max_ids: 工程師分片時每片最多幾支編號 (0 = 不分片)
+    模型名稱可用 "auto" (Flash 先跑，受影響項目交給 Pro 複核)，routing 記錄各 Agent 的升級項目與省下的時間
+    on_issue: 有給時本地結果先送出，Gemini 改串流生成，每完成一筆問題就呼叫 on_issue(已加 source 的問題)
+    on_progress(說明文字, 0~1)：各階段進度
+    prev_audit: 上一次回傳的 audit_state (增量稽核：只重跑受影響的滾輪編號)
+    回傳 {"job_no", "issues", "pages", "failed_pages", "failed_agents", "routing", "duplicates", "duplicate_candidates", "timings", "ocr_cache": {"hits", "misses"},
+          "tokens", "shards", "incremental", "from_cache", "audit_state"}
+    """
+    with span("audit_job", pages=len(page_bytes_list), eng_model=eng_model_name, acc_model=acc_model_name,
+              ocr_bundle=ocr_bundle, shard_max_ids=shard_max_ids, streaming=on_issue is not None) as root:
+        progress = on_progress or (lambda text, fraction: None)
+        t_start = time.time()
+        ocr_cache = get_ocr_cache()
+        page_results, cached_keys = {}, {}
+        hits = 0
+        for i, file_bytes in enumerate(page_bytes_list):
+            cache_key = cached_keys[i] = ocr_cache_key(file_bytes)
+            cached = ocr_cache.get(cache_key)
+            if cached:
+                hits += 1
+                page_results[i] = (cached['table_md'], cached['header_text'], cached['full_text'])
+
+        # 相同檔案 + 已有快取的全文先比一次，重複頁不送 OCR (影像雜湊相近的頁仍要 OCR 後比對全文)
+        image_hashes = [image_hash(b) for b in page_bytes_list] if skip_duplicates else []
+        page_keys = [cached_keys[i] for i in range(len(page_bytes_list))]
+        def page_texts():
+            return [r[2] if isinstance(r, tuple) else None for r in (page_results.get(i) for i in range(len(page_bytes_list)))]
+        duplicates = find_duplicates(image_hashes, page_texts(), page_keys) if skip_duplicates else {}
+
+        pending = [(i, io.BytesIO(b)) for i, b in enumerate(page_bytes_list) if i not in page_results and i not in duplicates]
+        misses = len(pending)
+        total = len(page_bytes_list) + 1  # 最後一格留給 Gemini
+        done_count = [len(page_results)]
+        if page_results: progress(f"讀取 {len(page_results)} 頁快取資料...", done_count[0] / total)
+
+        def on_page_done(i, result):
+            done_count[0] += 1
+            progress(f"Azure 正在掃描... 已完成 {done_count[0]}/{len(page_bytes_list) - len(duplicates)} 頁", done_count[0] / total)
+            if not isinstance(result, Exception):
+                table_md, header_snippet, full_content = result
+                ocr_cache.set(cached_keys[i], {"table_md": table_md, "header_text": header_snippet, "full_text": full_content})
+
+        with span("azure_ocr", pages=len(pending), bytes=sum(len(f.getvalue()) for _, f in pending)):
+            page_results.update(run_ocr_stage(pending, doc_endpoint, doc_key, max_workers=ocr_workers, on_page_done=on_page_done, bundle=ocr_bundle))
+        t_ocr = time.time()
+        # OCR 後再以全文比一次：影像相近的頁要全文也相同才排除，換角度重拍 (影像雜湊抓不到) 也靠這一步
+        if skip_duplicates: duplicates = find_duplicates(image_hashes, page_texts(), page_keys)
+        candidates = find_candidates(image_hashes, duplicates, page_texts()) if skip_duplicates else {}
+
+        extracted_data_list, failed_pages, fingerprints = [], [], []
+        full_text_for_search = ""
+        for i in range(len(page_bytes_list)):
+            result = page_results.get(i)
+            # 第一輪被判為重複、第二輪原始頁又被判為重複時，這頁沒有 OCR 結果 (等同遞移重複)
+            if i in duplicates or result is None: continue
+            if isinstance(result, Exception):
+                failed_pages.append({"page": i + 1, "error": str(result)})
+                continue
+            table_md, header_snippet, full_content = result
+            extracted_data_list.append({"page": i + 1, "table": table_md, "header_text": header_snippet})
+            fingerprints.append(cached_keys[i])  # 頁面指紋 = 圖片內容雜湊 (同時是增量稽核的比對依據)
+            full_text_for_search += full_content or ""
+
+        # 精簡表格 + 各 Agent 只收相關欄位 (Token 數只供顯示；實際序列化在各 Agent 入口)
+        job_ir = build_job_ir(extracted_data_list)
+        _, tokens_eng = serialize_for_agent(job_ir, "engineer", token_budget)
+        _, tokens_acc = serialize_for_agent(job_ir, "accountant", token_budget)
+        tokens_raw = estimate_tokens(build_raw_input(extracted_data_list))
+
+        with span("local_rules", pages=len(extracted_data_list)) as s:
+            parsed_pages = parse_pages(extracted_data_list)
+            local_eng = run_engineer_checks(parsed_pages)
+            local_acc = run_accountant_checks(parsed_pages, extracted_data_list)
+            s.set(issues=len(local_eng["issues"]) + len(local_acc["issues"]),
+                  residual=len(local_eng["residual"]) + len(local_acc["residual"]))
+        settings = [eng_model_name, acc_model_name, token_budget, shard_max_ids]
+        rules = rules_version()
+        plan = plan_delta(prev_audit, fingerprints, parsed_pages, settings, rules)
+
+        first_issue = []
+        def emit(issue):
+            if not first_issue: first_issue.append(time.time() - t_start)
+            on_issue(issue)
+        if on_issue:
+            for agent, local in (("engineer", local_eng), ("accountant", local_acc)):
+                for issue in local["issues"]: on_issue(dict(issue, source=issue_source(agent, issue, local=True)))
+        on_eng_issue = source_tagger("engineer", emit if on_issue else None)
+        on_acc_issue = source_tagger("accountant", emit if on_issue else None)
+        progress("Gemini 雙代理人正在平行稽核 (工程師 & 會計師)...", done_count[0] / total)
+
+        def run_engineer_stage():
+            if plan["mode"] == "reuse":
+                return remap_result(prev_audit["res_eng"], plan["page_map"])
+            if plan["mode"] == "full":
+                return run_engineer_agent(extracted_data_list, parsed_pages, full_text_for_search,
+                                          gemini_key, eng_model_name, local_eng, token_budget, shard_max_ids, on_eng_issue)
+            # delta：只送受影響編號的完整履歷，其餘沿用上一次結果
+            affected_data = filter_extracted_data(extracted_data_list, plan["affected_ids"])
+            delta_res = {"issues": []}
+            if affected_data:
+                delta_local = dict(local_eng, residual=[l for l in local_eng["residual"] if any(r in l for r in plan["affected_ids"])])
+                delta_res = run_engineer_agent(affected_data, parse_pages(affected_data), full_text_for_search,
+                                               gemini_key, eng_model_name, delta_local, token_budget, shard_max_ids, on_eng_issue)
+            merged = {"issues": merge_issues(prev_audit["res_eng"].get("issues", []), delta_res.get("issues", []), plan)}
+            for key in ("_routing", "_failed"):
+                if key in delta_res: merged[key] = delta_res[key]
+            return merged
+
+        def run_accountant_stage():
+            # 會計師：表格全部解析成功就直接用本地對帳結果，Gemini 只處理無法解析的部分
+            if not local_acc["residual"]:
+                return {"job_no": local_acc["job_no"], "issues": []}
+            if plan["mode"] != "full" and prev_audit["acc_residual"] == local_acc["residual"]:
+                return remap_result(prev_audit["res_acc"], plan["page_map"])
+            return run_accountant_agent(extracted_data_list, parsed_pages, full_text_for_search,
+                                        gemini_key, acc_model_name, local_acc, token_budget, on_acc_issue)
+
+        def timed(agent, func):
+            t0 = time.time()
+            with span(f"agent.{agent}", mode=plan["mode"]) as s:
+                result = func()
+                s.set(issues=len(result.get("issues", [])), cache_hit=bool(result.get("_from_cache")))
+            return result, time.time() - t0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            future_eng = executor.submit(bind(timed), "engineer", run_engineer_stage)
+            future_acc = executor.submit(bind(timed), "accountant", run_accountant_stage)
+            res_eng, time_eng = future_eng.result()
+            res_acc, time_acc = future_acc.result()
+        t_end = time.time()
+        progress("完成！", 1.0)
+
+        root.set(ocr_cache_hits=hits, ocr_cache_misses=misses, duplicates=len(duplicates), failed_pages=len(failed_pages),
+                 incremental=plan["mode"])
+        audit_state = build_audit_state(fingerprints, parsed_pages, settings, res_eng, res_acc, local_acc["residual"], rules)
+        job_no, all_issues = merge_agent_results(local_eng, res_eng, local_acc, res_acc)
+        return {
+            "job_no": job_no,
+            "issues": all_issues,
+            "pages": len(page_bytes_list),
+            "failed_pages": failed_pages,
+            "failed_agents": [name for name, res in (("engineer", res_eng), ("accountant", res_acc)) if res.get("_failed")],
+            "routing": {name: res["_routing"] for name, res in (("engineer", res_eng), ("accountant", res_acc)) if "_routing" in res},
+            "duplicates": [{"page": i + 1, "dup_of": j + 1, "by": by} for i, (j, by) in sorted(duplicates.items())],
+            "duplicate_candidates": [{"page": i + 1, "like": j + 1} for i, j in sorted(candidates.items())],
+            "timings": {"ocr": round(t_ocr - t_start, 3), "agents": round(t_end - t_ocr, 3), "total": round(t_end - t_start, 3),
+                        "engineer": round(time_eng, 3), "accountant": round(time_acc, 3),
+                        "first_issue": round(first_issue[0], 3) if first_issue else None},
+            "ocr_cache": {"hits": hits, "misses": misses},
+            "tokens": {"raw": tokens_raw, "engineer": tokens_eng["tokens"], "accountant": tokens_acc["tokens"],
+                       "over_budget": tokens_eng["over_budget"] or tokens_acc["over_budget"]},
+            "shards": res_eng.get("shards"),
+            "incremental": {"mode": plan["mode"], "affected_ids": len(plan["affected_ids"])},
+            "from_cache": {"engineer": bool(res_eng.get("_from_cache")), "accountant": bool(res_acc.get("_from_cache"))},
+            "audit_state": audit_state,
+        }
@@ -0,0 +1,151 @@
+"""
+批次稽核 CLI (月底積壓用，不需要開 Streamlit)
+
+目錄結構：每個含有圖片的資料夾視為一份工令，頁序依檔名排序。
+    python batch_audit.py jobs/ -o results.jsonl --processes 4 --ocr-limit 8 --llm-limit 4
+
+- 多份工令以行程池平行處理，Azure / Gemini 的並行上限跨所有行程共用。
+- 每完成一份就寫一行 JSONL；中斷後重跑會跳過已成功的工令
+  (失敗的、或有頁面 OCR 失敗 / Agent 失敗的 partial 工令會重試)。
+- 送 OCR 前先做影像前處理 (轉正/裁切/壓縮，--no-prep 關閉)，結果記錄前後位元組數。
+- 金鑰從環境變數 DOC_ENDPOINT / DOC_KEY / GEMINI_KEY 讀取；規則檔與快取以程式所在目錄為準。
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from rule_index import RULES_PATH
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+MODEL_ALIASES = {"auto": "auto", "pro": "models/gemini-2.5-pro", "flash": "models/gemini-2.5-flash"}
+
+
+def _natural_key(name):
+    # P2.jpg 排在 P10.jpg 前面
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", name)]
+
+
+def discover_jobs(root):
+    """回傳 [(工令 ID = 相對路徑, [圖片路徑, ...]), ...]"""
+    jobs = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        images = sorted((f for f in filenames if f.lower().endswith(IMAGE_EXTS)), key=_natural_key)
+        if images:
+            job_id = os.path.relpath(dirpath, root)
+            jobs.append((job_id, [os.path.join(dirpath, f) for f in images]))
+    return jobs
+
+
+def load_finished(output_path):
+    """已成功寫入結果的工令 (續跑時跳過)"""
+    finished = set()
+    if not os.path.exists(output_path): return finished
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 上次中斷時寫到一半的行
+            if record.get("status") == "ok": finished.add(record["job_id"])
+    return finished
+
+
+def _init_worker(ocr_limit, llm_limit):
+    # 子行程才載入 Azure / Gemini SDK
+    import audit_core
+    audit_core.set_concurrency_limits(ocr_limit, llm_limit)
+
+
+def _run_job(job_id, paths, settings):
+    import audit_core
+    import image_prep
+    t0 = time.time()
+    try:
+        pages = []
+        for path in paths:
+            with open(path, "rb") as f: pages.append(f.read())
+        upload_bytes = {"before": sum(len(p) for p in pages)}
+        if settings["prep_images"]:
+            pages = [prepared for prepared, _ in image_prep.get_prep_executor().map(image_prep.prepare_page, pages)]
+        upload_bytes["after"] = sum(len(p) for p in pages)
+        result = audit_core.audit_job(
+            pages, settings["doc_endpoint"], settings["doc_key"], settings["gemini_key"],
+            settings["eng_model"], settings["acc_model"],
+            ocr_workers=settings["ocr_workers"], token_budget=settings["token_budget"], ocr_bundle=settings["ocr_bundle"],
+            shard_max_ids=settings["shard_max_ids"],
+        )
+        result.pop("audit_state", None)  # 增量稽核用的狀態只有 UI 需要
+        # 有頁面沒掃到 (例如 429 重試用完) 或 Agent 失敗時結果不完整，續跑時要重試
+        status = "partial" if result["failed_pages"] or result["failed_agents"] else "ok"
+        return {"job_id": job_id, "status": status, **result, "upload_bytes": upload_bytes}
+    except Exception as e:
+        return {"job_id": job_id, "status": "error", "error": f"{type(e).__name__}: {e}", "elapsed": round(time.time() - t0, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="中機交貨單批次稽核")
+    parser.add_argument("root", help="工令根目錄 (每個資料夾一份工令)")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="結果 JSONL 路徑 (可續跑)")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="同時處理的工令數")
+    parser.add_argument("--ocr-workers", type=int, default=4, help="單份工令內同時掃描頁數")
+    parser.add_argument("--no-prep", action="store_true", help="不做影像前處理 (轉正/裁切/壓縮)")
+    parser.add_argument("--shard-ids", type=int, default=40, help="工程師分片：每片最多幾支滾輪編號 (0 = 不分片)")
+    parser.add_argument("--no-bundle", action="store_true", help="OCR 逐頁送出 (不合併成單一 PDF)")
+    parser.add_argument("--ocr-limit", type=int, default=8, help="全部行程合計的 Azure 並行上限")
+    parser.add_argument("--llm-limit", type=int, default=4, help="全部行程合計的 Gemini 並行上限")
+    parser.add_argument("--eng-model", default="pro", help="工程師模型 (auto / pro / flash / 完整模型名稱)")
+    parser.add_argument("--acc-model", default="pro", help="會計師模型 (auto / pro / flash / 完整模型名稱)")
+    parser.add_argument("--token-budget", type=int, default=0, help="每個 Agent 輸入 Token 上限 (0 = 不限制)")
+    args = parser.parse_args(argv)
+
+    missing = [k for k in ("DOC_ENDPOINT", "DOC_KEY", "GEMINI_KEY") if not os.environ.get(k)]
+    if missing:
+        print(f"找不到金鑰環境變數: {', '.join(missing)}", file=sys.stderr)
+        return 2
+    if not os.path.exists(RULES_PATH):
+        print(f"找不到規則檔: {RULES_PATH} (可用 RULES_PATH 環境變數指定)", file=sys.stderr)
+        return 2
+
+    jobs = discover_jobs(args.root)
+    finished = load_finished(args.output)
+    todo = [(job_id, paths) for job_id, paths in jobs if job_id not in finished]
+    print(f"共 {len(jobs)} 份工令，已完成 {len(jobs) - len(todo)} 份，本次處理 {len(todo)} 份", file=sys.stderr)
+    if not todo: return 0
+
+    settings = {
+        "doc_endpoint": os.environ["DOC_ENDPOINT"], "doc_key": os.environ["DOC_KEY"], "gemini_key": os.environ["GEMINI_KEY"],
+        "eng_model": MODEL_ALIASES.get(args.eng_model, args.eng_model),
+        "acc_model": MODEL_ALIASES.get(args.acc_model, args.acc_model),
+        "ocr_workers": args.ocr_workers, "token_budget": args.token_budget or None,
+        "ocr_bundle": not args.no_bundle, "prep_images": not args.no_prep,
+        "shard_max_ids": args.shard_ids,
+    }
+
+    failed = 0
+    with multiprocessing.Manager() as manager:
+        ocr_limit = manager.BoundedSemaphore(args.ocr_limit)
+        llm_limit = manager.BoundedSemaphore(args.llm_limit)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.processes, initializer=_init_worker, initargs=(ocr_limit, llm_limit)) as executor, \
+                open(args.output, "a", encoding="utf-8") as out:
+            futures = {executor.submit(_run_job, job_id, paths, settings): job_id for job_id, paths in todo}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                if record["status"] != "ok": failed += 1
+                if record["status"] == "error": detail = record["error"]
+                else: detail = f"{len(record.get('issues', []))} 項異常"
+                if record["status"] == "partial":
+                    detail += f" (不完整：{len(record['failed_pages'])} 頁掃描失敗，失敗的 Agent: {'、'.join(record['failed_agents']) or '無'})"
+                print(f"[{done}/{len(todo)}] {record['job_id']}: {detail}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+離線替身：假的 Azure DocumentIntelligenceClient 與 Gemini GenerativeModel
+
+回放 bench/fixtures 內錄下的 AnalyzeResult / JSON 回應，
+並依設定的延遲分佈 (對數常態) 與錯誤率模擬真實服務，不花任何 API 額度。
+"""
+import copy
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from azure.ai.documentintelligence.models import AnalyzeResult
+from azure.core.exceptions import HttpResponseError
+
+from prompt_compact import estimate_tokens
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+STREAM_CHUNK_CHARS = 120
+STREAM_FIRST_CHUNK_SHARE = 0.3
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class LatencyModel:
+    """對數常態延遲：median 秒、p95 秒；time_scale 用來等比例縮短實際等待"""
+    def __init__(self, median, p95, time_scale=1.0):
+        self.mu = math.log(max(median, 1e-6))
+        self.sigma = max(0.0, (math.log(max(p95, median)) - self.mu) / 1.645)
+        self.time_scale = time_scale
+
+    def sample(self, rng):
+        return math.exp(rng.gauss(self.mu, self.sigma)) * self.time_scale
+
+
+class FakeConfig:
+    def __init__(self, azure_latency, gemini_latency, azure_429_rate=0.0, gemini_error_rate=0.0, seed=0, gemini_sec_per_1k_tokens=0.0):
+        self.azure_latency = azure_latency
+        self.gemini_latency = gemini_latency
+        self.gemini_sec_per_1k_tokens = gemini_sec_per_1k_tokens  # 輸入越長越慢 (分片稽核靠這個才量得出差異)
+        self.azure_429_rate = azure_429_rate
+        self.gemini_error_rate = gemini_error_rate
+        self.rng = random.Random(seed)
+        self.pages = {}  # 圖片 bytes -> AnalyzeResult dict
+        self.responses = {"engineer": load_fixture("gemini_engineer.json"), "accountant": load_fixture("gemini_accountant.json")}
+        self.lock = threading.Lock()
+        self.counters = {"azure_requests": 0, "azure_429": 0, "gemini_calls": 0, "gemini_errors": 0, "prompt_tokens": 0, "response_tokens": 0}
+
+    def count(self, name, n=1):
+        with self.lock: self.counters[name] += n
+
+    def roll(self, rate):
+        with self.lock: return self.rng.random() < rate
+
+    def sleep(self, latency, extra=0.0):
+        time.sleep(self.delay(latency, extra))
+
+    def delay(self, latency, extra=0.0):
+        with self.lock: delay = latency.sample(self.rng)
+        return delay + extra * latency.time_scale
+
+
+CONFIG = None  # 由 run_bench 設定
+
+
+class _FakeResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.reason = "Too Many Requests"
+        self.headers = headers
+
+
+def merge_pages(page_dicts):
+    """多張單頁 AnalyzeResult 合併成一份多頁結果 (模擬合併 PDF 送出)"""
+    merged = {"apiVersion": page_dicts[0].get("apiVersion"), "modelId": page_dicts[0].get("modelId"),
+              "content": "", "pages": [], "tables": []}
+    for page_number, page in enumerate(page_dicts, start=1):
+        if merged["content"]: merged["content"] += "\n"
+        offset = len(merged["content"])
+        merged["content"] += page["content"]
+        merged["pages"].append({"pageNumber": page_number, "spans": [{"offset": offset, "length": len(page["content"])}]})
+        for table in page["tables"]:
+            table = copy.deepcopy(table)
+            for region in table.get("boundingRegions", []): region["pageNumber"] = page_number
+            merged["tables"].append(table)
+    return merged
+
+
+def bundled_pages(pdf_bytes):
+    """合併 PDF 內嵌的 JPEG 原封不動，依出現位置找回註冊過的頁面"""
+    found = sorted((pdf_bytes.find(body), body) for body in CONFIG.pages if body in pdf_bytes)
+    return [CONFIG.pages[body] for _, body in found]
+
+
+class _FakePoller:
+    def __init__(self, body):
+        self._body = body
+
+    def result(self):
+        CONFIG.sleep(CONFIG.azure_latency)
+        if self._body.startswith(b"%PDF"):
+            return AnalyzeResult(merge_pages(bundled_pages(self._body)))
+        return AnalyzeResult(CONFIG.pages[self._body])
+
+
+class FakeDocumentIntelligenceClient:
+    def __init__(self, endpoint=None, credential=None, **kwargs):
+        self.endpoint = endpoint
+
+    def begin_analyze_document(self, model_id, body, **kwargs):
+        CONFIG.count("azure_requests")
+        if CONFIG.roll(CONFIG.azure_429_rate):
+            CONFIG.count("azure_429")
+            err = HttpResponseError(message="Too Many Requests")
+            err.status_code = 429
+            retry_after = CONFIG.azure_latency.time_scale
+            err.response = _FakeResponse(429, {"Retry-After": f"{retry_after:.3f}"})
+            raise err
+        body = body.getvalue() if hasattr(body, "getvalue") else body
+        return _FakePoller(body)
+
+
+class _FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, parts, generation_config=None, stream=False, **kwargs):
+        CONFIG.count("gemini_calls")
+        tokens = sum(estimate_tokens(p) for p in parts)
+        CONFIG.count("prompt_tokens", tokens)
+        delay = CONFIG.delay(CONFIG.gemini_latency, tokens / 1000 * CONFIG.gemini_sec_per_1k_tokens)
+        if CONFIG.roll(CONFIG.gemini_error_rate):
+            CONFIG.count("gemini_errors")
+            text = '{"issues": ['  # 被截斷的 JSON
+        else:
+            agent = "engineer" if "【工程師】" in parts[0] else "accountant"
+            text = json.dumps(CONFIG.responses[agent], ensure_ascii=False)
+            CONFIG.count("response_tokens", estimate_tokens(text))
+        if stream: return self._stream(text, delay)
+        time.sleep(delay)
+        return _FakeGeminiResponse(text)
+
+    @staticmethod
+    def _stream(text, delay):
+        # 首個片段前先等 STREAM_FIRST_CHUNK_SHARE 的延遲 (輸入處理)，其餘延遲平均分到各片段 (逐段生成)
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+        time.sleep(delay * STREAM_FIRST_CHUNK_SHARE)
+        for chunk in chunks:
+            time.sleep(delay * (1 - STREAM_FIRST_CHUNK_SHARE) / len(chunks))
+            yield _FakeGeminiResponse(chunk)
+
+
+class FakeGenai:
+    """取代 audit_core.genai (configure + GenerativeModel)"""
+    GenerativeModel = FakeGenerativeModel
+
+    @staticmethod
+    def configure(api_key=None, **kwargs):
+        pass
@@ -0,0 +1,195 @@
+"""
+離線效能基準 (OCR -> 規則比對 -> 雙代理人 -> 合併)
+
+以 bench/fakes.py 的替身取代 Azure 與 Gemini，對 1~100 頁的合成工令跑完整流程，
+輸出各階段 p50 / p95 與送出的 Token 數。用來在部署前抓到效能退化 (例如 OCR 又變成逐頁)。
+
+    python -m bench.run_bench --pages 1,10,30,100 --repeats 3
+    python -m bench.run_bench --ocr-workers 1        # 對照：單執行緒逐頁 OCR
+    python -m bench.run_bench --no-bundle            # 對照：不合併成單一 PDF
+    python -m bench.run_bench --shard-ids 0          # 對照：工程師不分片
+    python -m bench.run_bench --no-stream            # 對照：Gemini 不串流 (首筆問題要等整份回應)
+    python -m bench.run_bench --trace-file bench_spans.jsonl   # 另存 Span，結尾印出追蹤統計
+"""
+import argparse
+import copy
+import io
+import json
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from PIL import Image
+
+import audit_core
+import tracing
+from disk_cache import DiskCache
+from tracing import percentile
+from bench import fakes
+
+ROLL_ID_RE = re.compile(r"Y\d{7}")
+# 要計時的 audit_core 函數 -> 階段名稱
+STAGES = {
+    "extract_layout_with_azure": "azure_ocr(每頁)",
+    "extract_bundle_with_azure": "azure_ocr(合併)",
+    "get_dynamic_rules": "rule_match",
+    "run_engineer_checks": "local_engineer",
+    "run_accountant_checks": "local_accountant",
+    "build_job_ir": "prompt_assembly",
+    "serialize_for_agent": "prompt_assembly",
+    "call_gemini_json": "gemini(每次呼叫)",
+    "merge_agent_results": "merge",
+}
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self.lock: self.samples[stage].append(time.perf_counter() - t0)
+        return timed
+
+
+def synthetic_image(job_idx, page_idx, n_pages):
+    """很小的雜訊 JPEG：每頁 bytes 與影像雜湊都不同 (不會被當成重複頁)"""
+    rng = random.Random(f"{n_pages}-{job_idx}-{page_idx}")
+    output = io.BytesIO()
+    Image.frombytes("L", (64, 90), rng.randbytes(64 * 90)).save(output, "JPEG")
+    return output.getvalue()
+
+
+def synthetic_page(template, job_idx, page_idx):
+    """每頁換一組滾輪編號，讓快取/解析都當作不同頁面"""
+    page = copy.deepcopy(template)
+    def rewrite(text):
+        return ROLL_ID_RE.sub(lambda m: f"Y{job_idx % 10}{page_idx:03d}{m.group(0)[-3:]}", text)
+    page["content"] = rewrite(page["content"])
+    for table in page["tables"]:
+        for cell in table["cells"]: cell["content"] = rewrite(cell["content"])
+    return page
+
+
+ORIGINALS = {name: getattr(audit_core, name) for name in STAGES}
+
+def install_fakes(config, timer):
+    fakes.CONFIG = config
+    audit_core.DocumentIntelligenceClient = fakes.FakeDocumentIntelligenceClient
+    audit_core._doc_clients.clear()
+    audit_core.genai = fakes.FakeGenai
+    for name, stage in STAGES.items():
+        setattr(audit_core, name, timer.wrap(stage, ORIGINALS[name]))
+
+
+def reset_caches(warm):
+    # 冷啟動：每個工令都用全新的快取目錄；warm 則整輪共用
+    if warm and audit_core._ocr_cache is not None: return
+    audit_core._ocr_cache = DiskCache(tempfile.mkdtemp(prefix="bench_ocr_"))
+    audit_core._llm_cache = DiskCache(tempfile.mkdtemp(prefix="bench_llm_"))
+
+
+def run(args):
+    config = fakes.FakeConfig(
+        azure_latency=fakes.LatencyModel(args.azure_median, args.azure_p95, args.time_scale),
+        gemini_latency=fakes.LatencyModel(args.gemini_median, args.gemini_p95, args.time_scale),
+        azure_429_rate=args.azure_429_rate, gemini_error_rate=args.gemini_error_rate, seed=args.seed,
+        gemini_sec_per_1k_tokens=args.gemini_sec_per_1k_tokens,
+    )
+    template = fakes.load_fixture("analyze_result_page.json")
+    report = []
+    for n_pages in args.pages:
+        timer = StageTimer()
+        install_fakes(config, timer)
+        for key in config.counters: config.counters[key] = 0
+        job_totals, first_issues = [], []
+        for rep in range(args.repeats):
+            reset_caches(args.warm_cache)
+            job_idx = rep if args.warm_cache else len(report) * args.repeats + rep
+            pages = []
+            for i in range(n_pages):
+                body = synthetic_image(job_idx, i, n_pages)
+                config.pages[body] = synthetic_page(template, job_idx, i)
+                pages.append(body)
+            t0 = time.perf_counter()
+            first = []
+            def on_issue(issue):
+                # 只算 Gemini 的問題 (本地結果在呼叫 Gemini 前就有了)
+                if not first and not issue["source"].endswith("(本地)"): first.append(time.perf_counter() - t0)
+            result = audit_core.audit_job(pages, "https://fake", "fake", "fake", args.eng_model, args.acc_model,
+                                          ocr_workers=args.ocr_workers, token_budget=args.token_budget or None,
+                                          ocr_bundle=not args.no_bundle, shard_max_ids=args.shard_ids,
+                                          on_issue=None if args.no_stream else on_issue)
+            job_totals.append(time.perf_counter() - t0)
+            if args.no_stream:
+                # 不串流：首筆 Gemini 問題要等最後一個 Agent 回來才看得到
+                if any(not i["source"].endswith("(本地)") for i in result["issues"]): first_issues.append(job_totals[-1])
+            elif first:
+                first_issues.append(first[0])
+        stages = {stage: {"p50": percentile(v, 50), "p95": percentile(v, 95), "n": len(v)} for stage, v in timer.samples.items()}
+        stages["first_gemini_issue"] = {"p50": percentile(first_issues, 50), "p95": percentile(first_issues, 95), "n": len(first_issues)}
+        stages["job_total"] = {"p50": percentile(job_totals, 50), "p95": percentile(job_totals, 95), "n": len(job_totals)}
+        report.append({"pages": n_pages, "stages": stages, "counters": dict(config.counters),
+                       "prompt_tokens_per_job": config.counters["prompt_tokens"] / args.repeats})
+    return report
+
+
+def print_report(report, out):
+    for entry in report:
+        c = entry["counters"]
+        print(f"\n=== {entry['pages']} 頁 | Azure 請求 {c['azure_requests']} (429: {c['azure_429']}) | "
+              f"Gemini 呼叫 {c['gemini_calls']} (錯誤: {c['gemini_errors']}) | 每份送出 Token {entry['prompt_tokens_per_job']:.0f} ===", file=out)
+        print(f"{'階段':<22}{'p50(ms)':>10}{'p95(ms)':>10}{'樣本':>6}", file=out)
+        for stage, s in entry["stages"].items():
+            print(f"{stage:<22}{s['p50'] * 1000:>10.1f}{s['p95'] * 1000:>10.1f}{s['n']:>6}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="離線效能基準 (不呼叫真實 API)")
+    parser.add_argument("--pages", default="1,5,15,30,100", help="合成工令頁數，逗號分隔")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--ocr-workers", type=int, default=4)
+    parser.add_argument("--token-budget", type=int, default=0)
+    parser.add_argument("--shard-ids", type=int, default=40, help="工程師分片：每片最多幾支滾輪編號 (0 = 不分片)")
+    parser.add_argument("--no-bundle", action="store_true", help="OCR 逐頁送出 (不合併成單一 PDF)")
+    parser.add_argument("--no-stream", action="store_true", help="Gemini 不串流 (量測首筆問題的對照組)")
+    parser.add_argument("--eng-model", default="models/gemini-2.5-pro")
+    parser.add_argument("--acc-model", default="models/gemini-2.5-pro")
+    parser.add_argument("--azure-median", type=float, default=3.0, help="Azure 單頁延遲中位數 (秒)")
+    parser.add_argument("--azure-p95", type=float, default=6.0)
+    parser.add_argument("--gemini-median", type=float, default=20.0, help="Gemini 單次呼叫延遲中位數 (秒)")
+    parser.add_argument("--gemini-p95", type=float, default=45.0)
+    parser.add_argument("--gemini-sec-per-1k-tokens", type=float, default=3.0, help="Gemini 延遲隨輸入增加：每 1k 輸入 Token 多幾秒")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="實際等待 = 模擬延遲 x 此倍率")
+    parser.add_argument("--azure-429-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--warm-cache", action="store_true", help="重複跑同一份工令 (量測快取命中路徑)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json-out", help="另存完整結果 JSON")
+    parser.add_argument("--trace-file", help="Span JSONL 路徑 (不給就不記錄)")
+    args = parser.parse_args(argv)
+    args.pages = [int(p) for p in args.pages.split(",") if p.strip()]
+    tracing.set_sink(args.trace_file)  # 預設不寫進正式的追蹤檔
+
+    report = run(args)
+    print_report(report, sys.stdout)
+    if args.trace_file:
+        print("\n=== 追蹤統計 (tracing.summarize) ===")
+        tracing.format_summary(tracing.summarize(tracing.load_spans(args.trace_file), last_jobs=len(args.pages) * args.repeats))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
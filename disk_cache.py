@@ -0,0 +1,142 @@
+"""
+磁碟型內容定址快取 (Content-addressed disk cache)
+
+- 以「內容雜湊」當鍵，值存成 JSON 檔，跨 Streamlit session / 重新啟動都能共用。
+- 寫入採「暫存檔 + os.replace」原子替換，多個 session 同時寫也不會讀到半個檔案。
+- 以檔案 mtime 當作最近使用時間，超過容量 (筆數或位元組) 時淘汰最久沒用的 (LRU)。
+  容量以累計值追蹤，只有超過上限或每 RESYNC_SECONDS 才掃描整個目錄 (多個行程共用目錄時靠這個校正)；
+  淘汰時一次降到上限的 EVICT_LOW_WATER，避免到達上限後每次寫入都要掃描。
+- 可設定 ttl (秒)，過期的項目視為未命中並刪除。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+RESYNC_SECONDS = 300
+EVICT_LOW_WATER = 0.9
+
+
+def content_key(*parts):
+    """把多段內容 (bytes 或 str) 串成 sha256 雜湊，段與段之間加分隔避免碰撞。"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str): part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def atomic_write(path, data):
+    """暫存檔 + os.replace 寫入 bytes：多個 session 同時寫同一個檔也不會讀到半個檔案"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+
+
+class DiskCache:
+    def __init__(self, root, max_bytes=500 * 1024 * 1024, max_entries=20000, ttl=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._bytes = None   # 累計容量 (None = 還沒掃描過)
+        self._count = None
+        self._synced = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        # 前兩碼分資料夾，避免單一資料夾檔案過多
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            value = entry["value"]
+            expired = self.ttl is not None and time.time() - entry["created"] > self.ttl
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            with self._lock: self.misses += 1
+            return None
+        if expired:
+            try: os.remove(path)
+            except OSError: pass
+            with self._lock: self.misses += 1
+            return None
+        try:
+            os.utime(path, None)  # 更新最近使用時間 (LRU)
+        except OSError:
+            pass
+        with self._lock: self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        data = json.dumps({"created": time.time(), "value": value}, ensure_ascii=False).encode("utf-8")
+        try:
+            old_size = os.stat(path).st_size
+        except OSError:
+            old_size = None
+        atomic_write(path, data)
+        with self._lock:
+            stale = self._bytes is None or time.time() - self._synced > RESYNC_SECONDS
+            if not stale:
+                self._bytes += len(data) - (old_size or 0)
+                self._count += old_size is None
+            over = not stale and (self._bytes > self.max_bytes or self._count > self.max_entries)
+        if stale or over: self.evict()
+
+    def _entries(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".json"): continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st_ = os.stat(path)
+                except FileNotFoundError:
+                    continue  # 其他 session 剛好刪掉
+                entries.append((st_.st_mtime, st_.st_size, path))
+        return entries
+
+    def evict(self):
+        """掃描整個目錄校正容量；超過上限時淘汰到上限的 EVICT_LOW_WATER。回傳刪除筆數"""
+        if not self._evict_lock.acquire(blocking=False): return 0  # 其他執行緒正在掃描
+        try:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            if total > self.max_bytes or len(entries) > self.max_entries:
+                max_bytes, max_entries = self.max_bytes * EVICT_LOW_WATER, int(self.max_entries * EVICT_LOW_WATER)
+                entries.sort()  # mtime 由舊到新
+                for _, size, path in entries:
+                    if total <= max_bytes and len(entries) - removed <= max_entries: break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    removed += 1
+            with self._lock:
+                self._bytes, self._count, self._synced = total, len(entries) - removed, time.time()
+            return removed
+        finally:
+            self._evict_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,86 @@
+"""
+工程師 Agent 分片稽核 (Map-Reduce)
+
+大型工令一次送整份給 Gemini，延遲隨輸入長度增加，輸出太長時還會被截斷成 {"issues": []}。
+這裡依滾輪編號分片：每支編號的完整履歷 (跨頁、所有製程) 一定落在同一片，
+各片平行呼叫後再依固定順序合併，重複回報的問題與實測值只保留一次。
+"""
+from collections import OrderedDict
+
+from incremental import index_table_lines, filter_indexed
+
+SHARD_MAX_IDS = 40  # 每片最多幾支編號
+
+
+def roll_id_counts(parsed_pages):
+    """{編號: 資料筆數}，依第一次出現的頁序排列"""
+    counts = OrderedDict()
+    for page in parsed_pages:
+        for entry in page["entries"]:
+            counts[entry["roll_id"]] = counts.get(entry["roll_id"], 0) + 1
+    return counts
+
+
+def plan_shards(parsed_pages, max_ids=SHARD_MAX_IDS):
+    """
+    回傳 [[編號, ...], ...]。編號維持出現順序切段 (同一片集中在相鄰頁，表頭重複最少)，
+    並以資料筆數平衡各片大小；編號數不超過 max_ids 時只有一片。
+    """
+    counts = roll_id_counts(parsed_pages)
+    if not counts: return []
+    n_shards = -(-len(counts) // max_ids)
+    target = sum(counts.values()) / n_shards
+    shards, current, size = [], [], 0
+    for roll_id, n in counts.items():
+        current.append(roll_id)
+        size += n
+        if size >= target or len(current) >= max_ids:
+            shards.append(current)
+            current, size = [], 0
+    if current: shards.append(current)
+    return shards
+
+
+def build_shard_jobs(extracted_data_list, parsed_pages, local_result, shards):
+    """
+    回傳 [(該片的 extracted_data_list, 該片的本地結果), ...]
+    沒有任何編號的頁面與 residual 行 (項目分類不明等) 放在第一片，避免漏檢也避免每片重複送。
+    """
+    all_ids = set(roll_id_counts(parsed_pages))
+    id_less_pages = [data for data, page in zip(extracted_data_list, parsed_pages) if not page["entries"]]
+    residual = local_result["residual"] if local_result else []
+    indexed = index_table_lines(extracted_data_list)
+    jobs = []
+    for n, shard in enumerate(shards):
+        ids = set(shard)
+        data = filter_indexed(indexed, ids)
+        lines = [l for l in residual if any(r in l for r in ids)]
+        if n == 0:
+            data = sorted(data + id_less_pages, key=lambda d: d["page"])
+            lines = [l for l in residual if not any(r in l for r in all_ids)] + lines
+        jobs.append((data, dict(local_result, residual=lines) if local_result else None))
+    return jobs
+
+
+def _failure_key(failure):
+    return str(failure.get("id", "")).upper(), str(failure.get("val", ""))
+
+
+def reduce_shard_results(results):
+    """
+    依分片順序合併 (與完成順序無關，結果穩定)；
+    同一 (頁碼, 項目, 類型, 原因) 的問題合併成一筆，failures 依 (id, val) 去重。
+    """
+    merged = OrderedDict()
+    for result in results:
+        for issue in result.get("issues", []):
+            key = (str(issue.get("page")), issue.get("item"), issue.get("issue_type"), issue.get("common_reason"))
+            if key not in merged:
+                merged[key] = dict(issue, failures=[])
+            target = merged[key]["failures"]
+            seen = {_failure_key(f) for f in target}
+            for failure in issue.get("failures") or []:
+                if _failure_key(failure) in seen: continue
+                seen.add(_failure_key(failure))
+                target.append(failure)
+    return {"issues": list(merged.values())}
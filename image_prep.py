@@ -0,0 +1,207 @@
+"""
+上傳前的影像前處理 (手機照片 -> 適合 OCR 的小檔案)
+
+手機照片常常一張好幾 MB，在廠區 Wi-Fi 上傳 Azure 的時間比辨識本身還久。
+這裡在背景執行緒依序做：
+1. 套用 EXIF 方向 (直拍/橫拍) ；
+2. 縮小到目標 DPI (以 A4 長邊估算，只縮不放)；
+3. 估計傾斜角度並轉正；
+4. 裁掉紙張以外的桌面背景；
+5. 重新壓縮，取最小的格式 (幾乎無彩度的照片轉灰階)。
+判斷不確定時一律不動 (寧可不裁/不轉，也不要切掉表格)。
+"""
+import concurrent.futures
+import io
+import os
+import threading
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+TARGET_DPI = int(os.environ.get("PREP_TARGET_DPI", "200"))
+PAGE_LONG_EDGE_INCHES = 11.7  # A4 長邊
+JPEG_QUALITY = int(os.environ.get("PREP_JPEG_QUALITY", "85"))
+ANALYSIS_EDGE = 800           # 傾斜/裁切只在縮圖上估計
+SKEW_MAX_ANGLE = 5.0          # 只處理 ±5 度以內的傾斜
+SKEW_COARSE_STEP = 0.5        # 粗掃間距 (度)
+SKEW_FINE_STEP = 0.1          # 粗掃最佳角度左右一格內的細掃間距
+SKEW_TOP_ROWS = 5             # 格線強度取最黑的幾列
+SKEW_MASK_ERODE = 3           # 紙張範圍內縮幾個像素 (分析縮圖上)
+SKEW_MIN_GAIN = 1.15          # 轉正後格線強度要比不轉高這麼多倍才轉
+CROP_MIN_AREA, CROP_MAX_AREA = 0.3, 0.95
+CROP_MARGIN = 0.02
+CROP_MIN_FILL = 0.2           # 列/欄中紙張亮度像素至少佔此比例才算紙張範圍
+GRAY_MAX_SPREAD = 12          # RGB 三通道平均差異低於此值視為灰階文件
+
+
+def _analysis_gray(image):
+    thumb = image.convert("L")
+    thumb.thumbnail((ANALYSIS_EDGE, ANALYSIS_EDGE))
+    return thumb
+
+
+def _paper_level(gray):
+    # 畫面中央一半的區域大多是紙張，取其中位數當紙張亮度
+    h, w = gray.shape
+    return float(np.median(gray[h // 4:3 * h // 4, w // 4:3 * w // 4]))
+
+
+def _paper_mask(gray, level):
+    """
+    紙張範圍 (bool 陣列)：每列、每欄從第一個到最後一個紙張亮度像素之間都算紙張 (含紙上的墨水)，
+    兩者取交集後再內縮幾個像素，桌面與紙張邊緣的明暗交界不算進去。
+    """
+    bright = gray > level * 0.8
+    h, w = gray.shape
+    rows, cols = np.zeros_like(bright), np.zeros_like(bright)
+    for r in np.flatnonzero(bright.mean(axis=1) > CROP_MIN_FILL):
+        idx = np.flatnonzero(bright[r])
+        rows[r, idx[0]:idx[-1] + 1] = True
+    for c in np.flatnonzero(bright.mean(axis=0) > CROP_MIN_FILL):
+        idx = np.flatnonzero(bright[:, c])
+        cols[idx[0]:idx[-1] + 1, c] = True
+    mask = Image.fromarray(((rows & cols) * 255).astype(np.uint8))
+    return mask.filter(ImageFilter.MinFilter(SKEW_MASK_ERODE * 2 + 1))
+
+
+def _line_strength(thumb, mask, level, angle):
+    """
+    轉 angle 度後，最黑的 SKEW_TOP_ROWS 列平均墨水量 (表格格線/文字基線轉正時整條落在同一列)。
+    只算紙張範圍內的像素：桌面背景與旋轉後露出的角落比格線還暗，算進去會蓋過格線。
+    """
+    rotated = np.asarray(thumb.rotate(angle, resample=Image.BILINEAR, fillcolor=255), dtype=np.float32)
+    on_paper = np.asarray(mask.rotate(angle, resample=Image.NEAREST, fillcolor=0)) > 0
+    # 連續的墨水深度 (不二值化)：縮圖後細格線只剩淺灰也算得到
+    ink = (np.clip(level - rotated, 0, None) * on_paper).sum(axis=1)
+    return float(np.sort(ink)[-SKEW_TOP_ROWS:].mean())
+
+
+def estimate_skew(thumb):
+    """
+    Hough / Radon 投影：每個角度取「最強的幾列」的墨水量，轉正時格線整條落在同一列，峰值最高。
+    (相鄰列差異平方和在等距表格上會在錯誤角度出現假峰值，甚至選到反方向)
+    只在紙張範圍內計分；先以 SKEW_COARSE_STEP 粗掃，再在最佳角度兩側以 SKEW_FINE_STEP 細掃；
+    轉正後的格線強度要比不轉明顯提高才轉 (否則回傳 0)。
+    """
+    gray = np.asarray(thumb)
+    level = _paper_level(gray)
+    mask = _paper_mask(gray, level)
+    strength = {}
+    def measure(angle):
+        angle = round(float(angle), 2)
+        if angle not in strength: strength[angle] = _line_strength(thumb, mask, level, angle)
+        return strength[angle]
+
+    coarse = max(np.arange(-SKEW_MAX_ANGLE, SKEW_MAX_ANGLE + 1e-6, SKEW_COARSE_STEP), key=measure)
+    fine = np.arange(coarse - SKEW_COARSE_STEP, coarse + SKEW_COARSE_STEP + 1e-6, SKEW_FINE_STEP)
+    best = round(float(max((a for a in fine if abs(a) <= SKEW_MAX_ANGLE), key=measure)), 2)
+    if best == 0.0 or measure(best) <= measure(0.0) * SKEW_MIN_GAIN: return 0.0
+    return best
+
+
+def estimate_crop(thumb):
+    """回傳紙張範圍 (left, top, right, bottom；0~1 比例)，找不到可信的範圍回傳 None"""
+    gray = np.asarray(thumb)
+    bright = gray > _paper_level(gray) * 0.8
+    # 表格文字很密時整列的紙張比例不高，只要求明顯多於桌面雜訊
+    rows = np.flatnonzero(bright.mean(axis=1) > CROP_MIN_FILL)
+    cols = np.flatnonzero(bright.mean(axis=0) > CROP_MIN_FILL)
+    if not len(rows) or not len(cols): return None
+    h, w = gray.shape
+    box = (max(0.0, cols[0] / w - CROP_MARGIN), max(0.0, rows[0] / h - CROP_MARGIN),
+           min(1.0, (cols[-1] + 1) / w + CROP_MARGIN), min(1.0, (rows[-1] + 1) / h + CROP_MARGIN))
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if not CROP_MIN_AREA <= area <= CROP_MAX_AREA: return None
+    return box
+
+
+def _border_fill(image):
+    """旋轉後露出的角落用照片邊緣的顏色 (通常是桌面) 填滿，裁切時才會一起切掉"""
+    edge = np.asarray(image.resize((64, 64)))
+    border = np.concatenate([edge[0], edge[-1], edge[:, 0], edge[:, -1]])
+    fill = np.median(border, axis=0)
+    return int(fill) if image.mode == "L" else tuple(int(c) for c in fill)
+
+
+def _is_grayscale(image):
+    if image.mode == "L": return True
+    thumb = np.asarray(image.convert("RGB").resize((64, 64)), dtype=np.int16)
+    return float((thumb.max(axis=2) - thumb.min(axis=2)).mean()) < GRAY_MAX_SPREAD
+
+
+def _encode_smallest(image):
+    candidates = []
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    candidates.append(("JPEG", out.getvalue()))
+    # 截圖/掃描檔顏色很少時 PNG 反而更小且無失真
+    if image.getcolors(256) is not None:
+        out = io.BytesIO()
+        image.save(out, "PNG", optimize=True)
+        candidates.append(("PNG", out.getvalue()))
+    return min(candidates, key=lambda c: len(c[1]))
+
+
+def prepare_page(file_bytes):
+    """
+    回傳 (處理後 bytes, info)
+    info: {"bytes_before", "bytes_after", "size_before", "size_after", "format", "skew", "cropped", "error"}
+    無法處理的檔案原樣回傳 (error 記錄原因)，不影響後續 OCR。
+    """
+    info = {"bytes_before": len(file_bytes), "bytes_after": len(file_bytes), "size_before": None, "size_after": None,
+            "format": None, "skew": 0.0, "cropped": False, "error": None}
+    try:
+        original = Image.open(io.BytesIO(file_bytes))
+        info["size_before"] = original.size
+        max_edge = int(TARGET_DPI * PAGE_LONG_EDGE_INCHES)
+        original.draft("RGB", (max_edge, max_edge))  # JPEG 直接以 1/2、1/4 解碼，省下大半解碼時間
+        image = ImageOps.exif_transpose(original)
+        changed = original.getexif().get(0x0112, 1) != 1  # EXIF Orientation 標籤
+
+        if max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            changed = True
+        image = image.convert("L") if _is_grayscale(image) else image.convert("RGB")
+
+        skew = estimate_skew(_analysis_gray(image))
+        if skew:
+            image = image.rotate(skew, resample=Image.BICUBIC, expand=True, fillcolor=_border_fill(image))
+            info["skew"] = skew
+            changed = True
+
+        box = estimate_crop(_analysis_gray(image))
+        if box:
+            w, h = image.size
+            image = image.crop((int(box[0] * w), int(box[1] * h), int(box[2] * w), int(box[3] * h)))
+            info["cropped"] = changed = True
+
+        fmt, encoded = _encode_smallest(image)
+    except Exception as e:
+        info["error"] = f"{type(e).__name__}: {e}"
+        return file_bytes, info
+
+    # 沒有任何幾何變動且重新壓縮也沒有變小 -> 保留原檔 (避免多壓一次失真)
+    if not changed and len(encoded) >= len(file_bytes):
+        info.update(format=original.format, size_after=original.size)
+        return file_bytes, info
+    info.update(bytes_after=len(encoded), size_after=image.size, format=fmt)
+    return encoded, info
+
+
+# 行程內共用的背景執行緒池 (Pillow 的縮圖/旋轉/壓縮會釋放 GIL，可以真的平行)
+PREP_WORKERS = int(os.environ.get("PREP_WORKERS", "4"))
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_prep_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=PREP_WORKERS, thread_name_prefix="image_prep")
+    return _executor
+
+
+def submit_prepare(file_bytes):
+    """丟到背景執行緒處理，回傳 Future[(bytes, info)]"""
+    return get_prep_executor().submit(prepare_page, file_bytes)
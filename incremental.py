@@ -0,0 +1,137 @@
+"""
+增量稽核 (相簿新增/刪除頁面時只重算受影響的部分)
+
+每頁以圖片內容雜湊當指紋，並記錄該頁出現的滾輪編號與項目 (依賴集合)。
+相簿變動後，只把「受影響編號的完整履歷 + 受影響項目」送給工程師 Agent，
+其餘編號沿用上一次的結果；頁碼依指紋重新對應。
+本地規則引擎本身只要幾毫秒，每次都對整份工令重算，不需要增量。
+"""
+from table_parser import normalize_roll_id, TABLE_TITLE_RE
+
+
+def page_dependencies(parsed_page):
+    return {
+        "roll_ids": sorted({e["roll_id"] for e in parsed_page["entries"]}),
+        "items": sorted({i["item"] for i in parsed_page["items"]}),
+    }
+
+
+def build_audit_state(fingerprints, parsed_pages, settings, res_eng, res_acc, acc_residual, rules=None):
+    """
+    存進 session_state 給下一次增量比對用。rules = 規則檔版本 (rules_version)。
+    任一 Agent 失敗 (_failed) 時回傳 None：失敗的空結果不能被下一次沿用成「全數合格」。
+    """
+    if res_eng.get("_failed") or res_acc.get("_failed"): return None
+    return {
+        "fingerprints": list(fingerprints),
+        # 真正的頁碼 (失敗頁、重複頁不在 fingerprints 裡，但仍佔頁碼)
+        "pages": [p["page"] for p in parsed_pages],
+        "deps": {fp: page_dependencies(p) for fp, p in zip(fingerprints, parsed_pages)},
+        "settings": settings,
+        "res_eng": res_eng,
+        "res_acc": res_acc,
+        "acc_residual": list(acc_residual),
+        "rules": rules,
+    }
+
+
+def plan_delta(prev_state, fingerprints, parsed_pages, settings, rules=None):
+    """
+    回傳 {"mode": "full" | "delta" | "reuse", "affected_ids", "affected_items", "page_map"}
+    page_map: 舊頁碼(str) -> 新頁碼(str)，被刪除的頁不在裡面。
+    rules.xlsx 有變動時兩個 Agent 的提示詞都不同了，上一次的 Gemini 結果一律不沿用 (整份重跑)。
+    """
+    plan = {"mode": "full", "affected_ids": set(), "affected_items": set(), "page_map": {}}
+    if not prev_state or prev_state["settings"] != settings or "pages" not in prev_state: return plan
+    if prev_state.get("rules") != rules: return plan
+
+    new_index = {fp: p["page"] for fp, p in zip(fingerprints, parsed_pages)}
+    old_fps, new_fps = set(prev_state["fingerprints"]), set(fingerprints)
+    plan["page_map"] = {str(page): str(new_index[fp]) for fp, page in zip(prev_state["fingerprints"], prev_state["pages"]) if fp in new_index}
+
+    removed = old_fps - new_fps
+    added_pages = [p for fp, p in zip(fingerprints, parsed_pages) if fp not in old_fps]
+    if not removed and not added_pages:
+        plan["mode"] = "reuse"
+        return plan
+
+    for fp in removed:
+        plan["affected_ids"].update(prev_state["deps"][fp]["roll_ids"])
+        plan["affected_items"].update(prev_state["deps"][fp]["items"])
+    for page in added_pages:
+        deps = page_dependencies(page)
+        plan["affected_ids"].update(deps["roll_ids"])
+        plan["affected_items"].update(deps["items"])
+
+    # 變動頁有無法解析的表格時，無法確定影響範圍 -> 整份重跑
+    if any(p["unparsed"] or not (p["items"] or p["entries"]) for p in added_pages):
+        return dict(plan, mode="full")
+    plan["mode"] = "delta"
+    return plan
+
+
+def index_table_lines(extracted_data_list):
+    """
+    每頁表格逐行標記編號：[(data, [(line, 編號集合 或 None)])]
+    None = 表格標題列 (一律保留)；非表格行直接略過。分片時同一份索引可重複篩選。
+    """
+    indexed = []
+    for data in extracted_data_list:
+        lines = []
+        for line in (data.get("table") or "").splitlines():
+            stripped = line.strip()
+            if TABLE_TITLE_RE.match(stripped):
+                lines.append((line, None))
+            elif stripped.startswith("|"):
+                cells = [c.strip() for c in stripped.strip("|").split("|")]
+                lines.append((line, {normalize_roll_id(c) for c in cells} - {None}))
+        indexed.append((data, lines))
+    return indexed
+
+
+def filter_indexed(indexed, affected_ids):
+    filtered = []
+    for data, lines in indexed:
+        # 表頭/項目列 (沒有編號) 全部保留，編號列只留受影響的
+        kept = [line for line, ids in lines if not ids or ids & affected_ids]
+        if any(ids and ids & affected_ids for _, ids in lines):
+            filtered.append(dict(data, table="\n".join(kept)))
+    return filtered
+
+
+def filter_extracted_data(extracted_data_list, affected_ids):
+    """
+    只保留受影響編號所在的列 (含跨頁完整履歷)、項目列與表頭列，
+    讓 delta 稽核的輸入只跟變動的編號有關。
+    """
+    return filter_indexed(index_table_lines(extracted_data_list), affected_ids)
+
+
+def _remap_page(page, page_map):
+    page = str(page)
+    return page_map.get(page, page) if page.isdigit() else page
+
+
+def _issue_ids(issue):
+    return {str(f.get("id", "")).upper() for f in issue.get("failures") or []}
+
+
+def merge_issues(prev_issues, delta_issues, plan):
+    """
+    上一次的結果去掉受影響的編號/項目，頁碼重新對應後，再接上 delta 結果。
+    """
+    affected_ids, affected_items, page_map = plan["affected_ids"], plan["affected_items"], plan["page_map"]
+    merged = []
+    for issue in prev_issues:
+        if issue.get("item") in affected_items and not (_issue_ids(issue) - affected_ids):
+            continue
+        failures = [f for f in issue.get("failures") or [] if str(f.get("id", "")).upper() not in affected_ids]
+        if issue.get("failures") and not failures: continue
+        merged.append(dict(issue, page=_remap_page(issue.get("page", "?"), page_map), failures=failures))
+    return merged + list(delta_issues)
+
+
+def remap_result(result, page_map):
+    """整份沿用時只需要更新頁碼"""
+    issues = [dict(i, page=_remap_page(i.get("page", "?"), page_map)) for i in result.get("issues", [])]
+    return dict(result, issues=issues)
@@ -0,0 +1,243 @@
+"""
+本地背景工作佇列 (SQLite，不需要外部 broker)
+
+稽核原本直接跑在 Streamlit 按鈕的 handler 裡：點任何元件、手機鎖屏或 websocket 斷線都會
+觸發 rerun，跑到一半的稽核就不見了。改成：
+- 「開始分析」只把頁面與設定寫進佇列，立刻拿到工作 ID；
+- 行程內共用一組 worker 執行緒依序取出工作執行，進度、串流到的問題與結果都寫回 SQLite；
+- 頁面只負責輪詢 (重新整理或換 session 後用工作 ID 接回去)。
+Azure / Gemini 的並行上限由 worker pool 啟動時設定，所有 session 的工作共用同一組號誌。
+執行中的工作定期更新心跳，行程重啟後沒有心跳的工作會自動重新排隊。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+import audit_core
+
+log = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".jobs", "jobs.db"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))              # 同時執行的工令數
+JOB_OCR_LIMIT = int(os.environ.get("JOB_OCR_LIMIT", "8"))          # 全部 session 合計的 Azure 並行上限
+JOB_LLM_LIMIT = int(os.environ.get("JOB_LLM_LIMIT", "4"))          # 全部 session 合計的 Gemini 並行上限
+JOB_HEARTBEAT_SECONDS = 15
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", "120"))  # 執行中超過這麼久沒有心跳 -> 重新排隊
+JOB_RETENTION_HOURS = float(os.environ.get("JOB_RETENTION_HOURS", "24"))
+
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    updated REAL NOT NULL,
+    message TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    settings TEXT NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS job_pages (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS job_issues (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    issue TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_issues_job ON job_issues (job_id, seq);
+CREATE TABLE IF NOT EXISTS job_state (
+    job_id TEXT PRIMARY KEY,
+    prev_audit TEXT NOT NULL
+);
+"""
+
+
+class JobQueue:
+    """
+    handler(pages, settings, on_progress, on_issue, prev_audit) -> 可轉 JSON 的結果
+    settings 必須可轉 JSON (存進 SQLite；金鑰等不要放進去，由 handler 自己帶)。
+    prev_audit (增量稽核的上一次狀態，可能很大) 另存一張表，只在 worker 取出工作時讀一次，輪詢不會讀到。
+    """
+    def __init__(self, db_path, handler, workers=JOB_WORKERS):
+        self.db_path = db_path
+        self.handler = handler
+        self._wake = threading.Event()
+        self._running = set()
+        self._running_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        for n in range(max(1, workers)):
+            threading.Thread(target=self._worker_loop, name=f"job_worker_{n}", daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name="job_heartbeat", daemon=True).start()
+
+    def _connect(self):
+        # 每次操作各開一條連線 (sqlite3 連線不能跨執行緒共用)；isolation_level=None 交易自己下
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, pages, settings, prev_audit=None):
+        """寫入佇列並回傳工作 ID (不等執行)"""
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO jobs (id, status, created, updated, message, settings) VALUES (?, ?, ?, ?, ?, ?)",
+                         (job_id, QUEUED, now, now, "排隊中...", json.dumps(settings, ensure_ascii=False)))
+            conn.executemany("INSERT INTO job_pages (job_id, idx, data) VALUES (?, ?, ?)",
+                             [(job_id, i, sqlite3.Binary(p)) for i, p in enumerate(pages)])
+            if prev_audit is not None:
+                conn.execute("INSERT INTO job_state (job_id, prev_audit) VALUES (?, ?)",
+                             (job_id, json.dumps(prev_audit, ensure_ascii=False)))
+            conn.execute("COMMIT")
+        self.cleanup()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        """回傳工作狀態 dict (含排隊位置、結果)；不存在或已過期回傳 None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None: return None
+            job = dict(row)
+            job["position"] = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND created < ?",
+                                           (QUEUED, job["created"])).fetchone()[0] if job["status"] == QUEUED else 0
+        job["settings"] = json.loads(job["settings"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def issues(self, job_id):
+        """執行中串流收到的問題 (依收到順序)"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT issue FROM job_issues WHERE job_id = ? ORDER BY seq", (job_id,)).fetchall()
+        return [json.loads(r["issue"]) for r in rows]
+
+    def cleanup(self):
+        """刪掉保留期限以前結束的工作"""
+        cutoff = time.time() - JOB_RETENTION_HOURS * 3600
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            old = [r["id"] for r in conn.execute("SELECT id FROM jobs WHERE status IN (?, ?) AND finished < ?", (DONE, ERROR, cutoff))]
+            for job_id in old:
+                for table in ("job_issues", "job_pages", "job_state"):
+                    conn.execute(f"DELETE FROM {table} WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            conn.execute("COMMIT")
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with closing(self._connect()) as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _add_issue(self, job_id, issue):
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT INTO job_issues (job_id, issue) VALUES (?, ?)", (job_id, json.dumps(issue, ensure_ascii=False)))
+
+    def _claim(self):
+        """原子地取出最早的排隊工作 (多個 worker / 多個行程同時取也不會重複)；順便把沒有心跳的工作放回佇列"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("UPDATE jobs SET status = ?, message = ?, updated = ? WHERE status = ? AND updated < ?",
+                             (QUEUED, "上次執行中斷，重新排隊...", now, RUNNING, now - JOB_STALE_SECONDS))
+                row = conn.execute("SELECT id, settings FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = ?, started = ?, updated = ?, message = ?, progress = 0 WHERE id = ?",
+                                 (RUNNING, now, now, "開始處理...", row["id"]))
+                    # 重新執行時清掉上次串流到一半的問題
+                    conn.execute("DELETE FROM job_issues WHERE job_id = ?", (row["id"],))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if row is None: return None
+            pages = [bytes(r["data"]) for r in conn.execute("SELECT data FROM job_pages WHERE job_id = ? ORDER BY idx", (row["id"],))]
+            state = conn.execute("SELECT prev_audit FROM job_state WHERE job_id = ?", (row["id"],)).fetchone()
+        return row["id"], pages, json.loads(row["settings"]), json.loads(state["prev_audit"]) if state else None
+
+    def _run(self, job_id, pages, settings, prev_audit):
+        with self._running_lock: self._running.add(job_id)
+        try:
+            result = self.handler(
+                pages, settings,
+                lambda text, fraction: self._update(job_id, message=text, progress=fraction),
+                lambda issue: self._add_issue(job_id, issue),
+                prev_audit,
+            )
+            self._update(job_id, status=DONE, finished=time.time(), progress=1.0, message="完成！",
+                         result=json.dumps(result, ensure_ascii=False))
+        except Exception as e:
+            self._update(job_id, status=ERROR, finished=time.time(), error=f"{type(e).__name__}: {e}")
+        finally:
+            with self._running_lock: self._running.discard(job_id)
+        with closing(self._connect()) as conn:
+            # 結束後就不需要原始頁面與上一次的狀態
+            for table in ("job_pages", "job_state"):
+                conn.execute(f"DELETE FROM {table} WHERE job_id = ?", (job_id,))
+
+    def _worker_loop(self):
+        # 任何例外都不能讓 worker 執行緒結束 (否則之後的工作會永遠停在排隊中)
+        while True:
+            try:
+                job = self._claim()
+            except Exception:
+                log.exception("取出工作失敗")
+                job = None  # 資料庫暫時被鎖住，下一輪再取
+            if job is None:
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+            try:
+                self._run(*job)
+            except Exception as e:
+                # _run 自己記錄錯誤時又失敗 (例如資料庫被鎖住)：再試一次；仍失敗就等心跳逾時後自動重新排隊
+                log.exception("工作 %s 執行失敗", job[0])
+                cause = e.__context__ or e  # 記錄原本的錯誤，不是寫入失敗的錯誤
+                try:
+                    self._update(job[0], status=ERROR, finished=time.time(), error=f"{type(cause).__name__}: {cause}")
+                except Exception:
+                    log.exception("工作 %s 無法標記為失敗", job[0])
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            with self._running_lock: running = list(self._running)
+            for job_id in running:
+                try:
+                    with closing(self._connect()) as conn:
+                        conn.execute("UPDATE jobs SET updated = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING))
+                except sqlite3.Error:
+                    pass
+
+
+# 行程內共用一組 worker (所有 Streamlit session)
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue(handler):
+    """第一次呼叫時建立 worker pool 並設定全域 Azure / Gemini 並行上限；之後的 handler 參數會被忽略"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            audit_core.set_concurrency_limits(threading.BoundedSemaphore(JOB_OCR_LIMIT), threading.BoundedSemaphore(JOB_LLM_LIMIT))
+            _queue = JobQueue(JOB_DB_PATH, handler)
+    return _queue
@@ -0,0 +1,231 @@
+"""
+會計師 Agent 的本地對帳引擎 (不呼叫 Gemini)
+
+數量核對全部是算術：單位換算、獨立編號數、軸頸筆數、Keyway、運費與聚合統計、
+跨頁表頭一致性。這裡直接從 table_parser 的解析結果計算，輸出與
+agent_accountant_check 相同格式的 JSON；無法解析的部分放進 residual 交給 Gemini。
+"""
+import re
+from collections import Counter, OrderedDict
+
+from table_parser import (
+    PART_BODY, PART_JOURNAL, PART_KEYWAY, PART_INNER, PART_ASSEMBLY, PART_HEAT,
+    STAGE_PRE, STAGE_WELD, STAGE_FINISH, entries_frame, strip_name,
+)
+from local_engineer import IssueCollector
+
+HEADER_FIELDS = OrderedDict([
+    ("工令編號", re.compile(r"工令(?:編號|號碼|No\.?)?\s*[:：]?\s*([A-Z0-9][A-Z0-9\-]{3,})", re.I)),
+    ("預定交貨日期", re.compile(r"預定交(?:貨日期|期)\s*[:：]?\s*(\d{2,4}\s*[./]\s*\d{1,2}\s*[./]\s*\d{1,2})")),
+    ("實際交貨日期", re.compile(r"實際交(?:貨日期|期)\s*[:：]?\s*(\d{2,4}\s*[./]\s*\d{1,2}\s*[./]\s*\d{1,2})")),
+])
+DATE_FORMAT_RE = re.compile(r"^\d{3}\.\d{2}\.\d{2}$")
+
+FREIGHT_EXCEPTION = strip_name("W3 #1~6號機 130~145 ROLL ROLL BODY車修加工")
+AGGREGATE_EXCEPTION = strip_name("W3 #6 機 驅動輥輪")
+
+
+def unit_factor(item_name):
+    """數量單位換算：(1SET=4PCS) x4；(SET) x2；(PC) x1"""
+    name = strip_name(item_name)
+    if "(1SET=4PCS)" in name: return 4
+    if "(SET)" in name: return 2
+    return 1
+
+
+def freight_factor(item_name):
+    """運費專用：W3 #1~6 特例與 (1SET=4PCS) 視為 1 個單位；(SET) 視為 2 個；(PC) 直接累加"""
+    name = strip_name(item_name)
+    if FREIGHT_EXCEPTION in name or "(1SET=4PCS)" in name: return 1
+    if "(SET)" in name: return 2
+    return 1
+
+
+def parse_header(header_text):
+    """從頁首文字抓 工令編號 / 交貨日期；抓不到的欄位不放進結果"""
+    fields = {}
+    for name, pattern in HEADER_FIELDS.items():
+        m = pattern.search(header_text or "")
+        if m: fields[name] = "".join(m.group(1).split())
+    return fields
+
+
+def _num(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def _check_headers(extracted_data_list, out, residual):
+    values = {name: {} for name in HEADER_FIELDS}
+    for data in extracted_data_list:
+        fields = parse_header(data.get("header_text"))
+        for name in HEADER_FIELDS:
+            if name in fields:
+                values[name][data["page"]] = fields[name]
+            elif name == "工令編號":
+                residual.append(f"P.{data['page']} 頁首找不到 {name}")
+
+    for name, by_page in values.items():
+        if not by_page: continue
+        majority = Counter(by_page.values()).most_common(1)[0][0]
+        for page, value in by_page.items():
+            if value != majority:
+                out.add(page, name, "跨頁資訊不符", "所有頁面必須相同", "跨頁資訊不符", name, value, f"P.{page} {value} != {majority}")
+            if name != "工令編號" and not DATE_FORMAT_RE.match(value):
+                out.add(page, name, "跨頁資訊不符", "日期格式 YYY.MM.DD", "日期格式錯誤", name, value)
+    job_numbers = values["工令編號"]
+    return Counter(job_numbers.values()).most_common(1)[0][0] if job_numbers else None
+
+
+def _detail_items(parsed_pages):
+    """
+    有實測資料的項目 (同名跨頁合併，數量取第一次出現的值)；
+    declared: 每次出現時標示的數量 [(頁碼, 數量)]，跨頁續表時用來判斷是重複標示還是各頁分別標示
+    """
+    details = OrderedDict()
+    for page in parsed_pages:
+        for item in page["items"]:
+            if not item["has_entries"]: continue
+            merged = details.setdefault(item["item"], dict(item, declared=[]))
+            if item["qty"] is not None: merged["declared"].append((item["page"], _num(item["qty"])))
+    return details
+
+
+def _targets(item):
+    """
+    可接受的目標數量 (已換算)：續表每頁重複標示同一個總數，或各頁分別標示 (加總)，兩種都可能。
+    各頁標示的數量不同時只接受加總。
+    """
+    factor = unit_factor(item["item"])
+    values = [q for _, q in item["declared"]]
+    total = sum(values) * factor
+    if len(set(values)) > 1: return [total]
+    return sorted({values[0] * factor, total})
+
+
+def _summary_items(parsed_pages, detail_names):
+    """上方統計表格：有數量、沒有實測資料的項目；每頁重複出現只取單一值"""
+    summary = OrderedDict()
+    for page in parsed_pages:
+        for item in page["items"]:
+            if item["has_entries"] or item["qty"] is None or item["item"] in detail_names: continue
+            summary.setdefault(strip_name(item["item"]), item)
+    return summary
+
+
+def _check_quantities(df, details, out, residual):
+    counts = {}
+    for name, item in details.items():
+        rows = df[df["item"] == name]
+        part = item["part"]
+        if part == PART_BODY:
+            count = rows["roll_id"].nunique()
+            dup = rows["roll_id"].value_counts()
+            for roll_id, n in dup[dup > 1].items():
+                out.add(item["page"], name, "編號重複", "同一項目內編號不可重複", "編號重複", roll_id, str(n))
+        else:
+            count = len(rows)
+        counts[name] = count
+
+        if part == PART_HEAT: continue
+        if part not in (PART_BODY, PART_JOURNAL, PART_INNER, PART_ASSEMBLY, PART_KEYWAY):
+            residual.append(f"P.{item['page']} {name}: 無法判斷數量規則 (計數 {count})")
+            continue
+        if item["qty"] is None:
+            if part not in (PART_ASSEMBLY, PART_KEYWAY):  # 沒有數量欄就沒有比對目標 (Keyway 另有 <= 軸位再生規則)
+                residual.append(f"P.{item['page']} {name}: 找不到目標數量 (計數 {count})")
+            continue
+        targets = _targets(item)
+        if count in targets: continue
+        declared = "+".join(f"P.{p}:{q}" for p, q in item["declared"])
+        if part in (PART_ASSEMBLY, PART_KEYWAY):
+            # 組裝/拆裝、Keyway 等沒有明確的本地計數規則：對不上時交給 Gemini 判斷 (不能默默略過)
+            residual.append(f"P.{item['page']} {name}: 目標數量 {declared} (x{unit_factor(name)})，資料筆數 {count}")
+            continue
+        rule = "獨立編號數 = 目標數量" if part == PART_BODY else "資料總筆數 = 目標數量"
+        if len(item["declared"]) > 1:
+            calc = f"目標({declared})x{unit_factor(name)}={'或'.join(map(str, targets))} != 計算{count}"
+        else:
+            calc = f"目標{_num(item['qty'])}x{unit_factor(name)}={targets[0]} != 計算{count}"
+        out.add(item["page"], name, "數量不符", rule, "數量不符", "數量", str(count), calc)
+    return counts
+
+
+def _check_keyway(df, out):
+    keyway = df[df["part"] == PART_KEYWAY]
+    if keyway.empty: return
+    journal_finish = len(df[(df["part"] == PART_JOURNAL) & (df["stage"] == STAGE_FINISH)])
+    if len(keyway) > journal_finish:
+        first = keyway.iloc[0]
+        out.add(first["page"], first["item"], "數量不符", "Keyway 數量 <= 軸位再生數量", "Keyway多於軸位再生",
+                "Keyway", str(len(keyway)), f"Keyway{len(keyway)} > 軸位再生{journal_finish}")
+
+
+def _item_qty(item, counts):
+    """項目本身單位的數量：優先用數量欄 (各頁標示不同時取加總)，沒有就用實測計數換回原單位"""
+    values = [q for _, q in item.get("declared", [])]
+    if len(set(values)) > 1: return sum(values)
+    if item["qty"] is not None: return _num(item["qty"])
+    return _num(str(counts.get(item["item"], 0) / unit_factor(item["item"])))
+
+
+def _item_units(item, counts):
+    """聚合用的數量 (換算成支數，與 _check_quantities 的單位換算一致)：(SET) 1 = 2 支"""
+    return _item_qty(item, counts) * unit_factor(item["item"])
+
+
+def _check_summary(summary, details, counts, out, residual):
+    by_clean_name = {strip_name(n): item for n, item in details.items()}
+
+    def total(pred):
+        return sum(_item_units(i, counts) for i in details.values() if pred(i))
+
+    for clean, row in summary.items():
+        reported = _num(row["qty"])
+        if "運費" in clean:
+            # 運費有自己的換算 (freight_factor)，套在原單位數量上，不能再乘 unit_factor
+            computed = sum(_item_qty(i, counts) * freight_factor(i["item"]) for i in details.values()
+                           if i["part"] == PART_BODY and i["stage"] == STAGE_PRE)
+            logic = "運費 = 本體未再生車修 (依運費計數邏輯)"
+        elif AGGREGATE_EXCEPTION not in clean and any(k in clean for k in ("ROLL車修", "ROLL銲補", "ROLL拆裝")):
+            if "ROLL車修" in clean:
+                computed = total(lambda i: i["part"] in (PART_BODY, PART_JOURNAL) and i["stage"] in (STAGE_PRE, STAGE_FINISH))
+                logic = "車修 = 本體/軸頸 未再生 + 再生"
+            elif "ROLL銲補" in clean:
+                computed = total(lambda i: i["part"] in (PART_BODY, PART_JOURNAL) and i["stage"] == STAGE_WELD)
+                logic = "銲補 = 本體銲補 + 軸頸銲補"
+            else:
+                computed = total(lambda i: i["part"] == PART_ASSEMBLY)
+                logic = "拆裝 = 新品組裝 + 舊品拆裝"
+        elif clean in by_clean_name:
+            computed = _item_qty(by_clean_name[clean], counts)  # 同名項目單位相同
+            logic = "統計數 = 下方列表數"
+        else:
+            residual.append(f"P.{row['page']} 統計表格 {row['item']} = {row['qty']} (找不到對應明細)")
+            continue
+        if reported != computed:
+            out.add(row["page"], row["item"], "統計數量不符", logic, "統計數量不符", "統計", str(reported),
+                    f"統計{reported} != 計算{computed}")
+
+
+def run_accountant_checks(parsed_pages, extracted_data_list):
+    """
+    回傳 {"job_no", "issues": [...], "residual": [無法本地判定的資料描述]}
+    residual 為空代表整份文件都已在本地對帳完成，不需要再呼叫 Gemini。
+    """
+    out = IssueCollector()
+    residual = []
+    for page in parsed_pages:
+        residual.extend(f"P.{page['page']} {line}" for line in page["unparsed"])
+        if not page["items"] and not page["entries"]:
+            residual.append(f"P.{page['page']} 整頁表格無法解析")
+
+    job_no = _check_headers(extracted_data_list, out, residual)
+
+    df = entries_frame(parsed_pages)
+    details = _detail_items(parsed_pages)
+    counts = _check_quantities(df, details, out, residual)
+    _check_keyway(df, out)
+    _check_summary(_summary_items(parsed_pages, set(details)), details, counts, out, residual)
+
+    return {"job_no": job_no or "Unknown", "issues": out.issues(), "residual": residual}
@@ -0,0 +1,165 @@
+"""
+工程師 Agent 的本地規則引擎 (不呼叫 Gemini)
+
+把 table_parser 解析出的實測資料整理成「每支編號 × 每個製程階段」的欄式表，
+以向量化方式執行流程防呆 (Interlock)、尺寸順序與幽靈工件依賴檢查，
+輸出格式與 agent_engineer_check 相同的 issues。
+無法確定的資料 (項目分類不明、多筆數值無法配對) 放進 residual 交給 Gemini。
+"""
+from itertools import combinations
+
+import pandas as pd
+
+from table_parser import (
+    PART_BODY, PART_JOURNAL, PART_KEYWAY, PART_INNER,
+    STAGE_PRE, STAGE_WELD, STAGE_FINISH, STAGE_GRIND, STAGE_ORDER,
+    entries_frame,
+)
+
+TRACKED_PARTS = (PART_BODY, PART_JOURNAL)
+LATER_STAGES = (STAGE_WELD, STAGE_FINISH, STAGE_GRIND)
+SIZE_LOGIC = "未再生 < 研磨 < 再生車修 < 銲補"
+
+
+def _fmt(v):
+    return f"{v:g}"
+
+
+def _page_str(page):
+    # unstack 後頁碼可能變成 float (1.0)
+    try:
+        return str(int(page))
+    except (TypeError, ValueError):
+        return str(page)
+
+
+class IssueCollector:
+    """依 (頁碼, 項目, 類型, 原因) 聚合 failures，保持第一次出現的順序"""
+    def __init__(self):
+        self._issues = {}
+
+    def add(self, page, item, issue_type, spec_logic, reason, roll_id, val, calc=""):
+        page = _page_str(page)
+        key = (page, item, issue_type, reason)
+        if key not in self._issues:
+            self._issues[key] = {
+                "page": page, "item": item, "issue_type": issue_type,
+                "spec_logic": spec_logic, "common_reason": reason, "failures": [],
+            }
+        failure = {"id": roll_id, "val": val}
+        if calc: failure["calc"] = calc
+        if failure not in self._issues[key]["failures"]:
+            self._issues[key]["failures"].append(failure)
+
+    def issues(self):
+        return sorted(self._issues.values(), key=lambda i: (int(i["page"]) if i["page"].isdigit() else 0))
+
+
+def build_stage_table(df):
+    """
+    (部位, 編號) x 製程階段 的欄式表。
+    欄位為 MultiIndex (統計量, 階段)，統計量含 n / vmin / vmax / raw / page / item / is_integer。
+    """
+    tracked = df[df["part"].isin(TRACKED_PARTS) & df["stage"].notna()]
+    if tracked.empty: return None
+    agg = tracked.groupby(["part", "roll_id", "stage"], sort=False).agg(
+        n=("value", "size"), vmin=("value", "min"), vmax=("value", "max"),
+        raw=("raw", "first"), page=("page", "first"), item=("item", "first"),
+        is_integer=("is_integer", "all"),
+    )
+    wide = agg.unstack("stage")
+    # 補齊沒出現過的階段，後面的向量化運算就不用判斷欄位存在與否
+    for field in ("n", "vmin", "vmax", "raw", "page", "item", "is_integer"):
+        for stage in STAGE_ORDER:
+            if (field, stage) not in wide.columns: wide[(field, stage)] = pd.NA
+    return wide
+
+
+def _has(wide, stage):
+    return wide[("n", stage)].notna()
+
+
+def _check_interlock(wide, out):
+    body = wide[wide.index.get_level_values("part") == PART_BODY]
+    if not body.empty:
+        has_pre = _has(body, STAGE_PRE)
+        pre_int = body[("is_integer", STAGE_PRE)].fillna(False).astype(bool)
+
+        # 已完工 (小數) 卻又出現在後續流程
+        for stage in LATER_STAGES:
+            mask = has_pre & ~pre_int & _has(body, stage)
+            for (_, roll_id), row in body[mask].iterrows():
+                out.add(row[("page", stage)], row[("item", stage)], "流程異常", "未再生為小數(已完工)不可再加工",
+                        "已完工件重複加工", roll_id, row[("raw", STAGE_PRE)], f"未再生 {row[('raw', STAGE_PRE)]} → {stage}")
+
+        # 未完工 (整數) 卻沒進入銲補與再生車修
+        missing_weld = ~_has(body, STAGE_WELD)
+        missing_finish = ~_has(body, STAGE_FINISH)
+        mask = has_pre & pre_int & (missing_weld | missing_finish)
+        for (_, roll_id), row in body[mask].iterrows():
+            missing = [s for s in (STAGE_WELD, STAGE_FINISH) if pd.isna(row[("n", s)])]
+            out.add(row[("page", STAGE_PRE)], row[("item", STAGE_PRE)], "流程異常", "未再生為整數須進入銲補與再生車修",
+                    "未完工件中斷", roll_id, row[("raw", STAGE_PRE)], "缺少 " + "、".join(missing))
+
+    # 後向溯源：後續流程出現，但該部位沒有未再生紀錄
+    no_pre = ~_has(wide, STAGE_PRE)
+    for stage in LATER_STAGES:
+        mask = no_pre & _has(wide, stage)
+        for (part, roll_id), row in wide[mask].iterrows():
+            out.add(row[("page", stage)], row[("item", stage)], "流程異常", f"{stage}須有{part}未再生紀錄",
+                    "無未再生紀錄(幽靈工件)", roll_id, row[("raw", stage)])
+
+
+def _check_size_order(wide, out, residual):
+    for low, high in combinations(STAGE_ORDER, 2):
+        both = _has(wide, low) & _has(wide, high)
+        if not both.any(): continue
+        sub = wide[both]
+        # 所有配對都違反 -> 確定異常；部分配對違反 (例如軸頸兩端尺寸不同) -> 交給 Gemini
+        definite = sub[("vmin", low)].astype(float) >= sub[("vmax", high)].astype(float)
+        ambiguous = ~definite & (sub[("vmax", low)].astype(float) >= sub[("vmin", high)].astype(float))
+        for (part, roll_id), row in sub[definite].iterrows():
+            out.add(row[("page", high)], row[("item", high)], "尺寸異常", SIZE_LOGIC, "違反製程大小順序",
+                    roll_id, _fmt(row[("vmin", low)]),
+                    f"{low} {_fmt(row[('vmin', low)])} >= {high} {_fmt(row[('vmax', high)])}")
+        for (part, roll_id), row in sub[ambiguous].iterrows():
+            residual.append(f"{part} {roll_id}: {low} {_fmt(row[('vmin', low)])}~{_fmt(row[('vmax', low)])} / "
+                            f"{high} {_fmt(row[('vmin', high)])}~{_fmt(row[('vmax', high)])} (多筆數值無法配對)")
+
+
+def _check_dependencies(df, out):
+    body_ids = set(df.loc[df["part"] == PART_BODY, "roll_id"])
+    journal_finish_ids = set(df.loc[(df["part"] == PART_JOURNAL) & (df["stage"] == STAGE_FINISH), "roll_id"])
+
+    dependents = df[df["part"].isin((PART_JOURNAL, PART_KEYWAY, PART_INNER))]
+    for row in dependents[~dependents["roll_id"].isin(body_ids)].itertuples():
+        out.add(row.page, row.item, "依賴異常", "須有本體紀錄", "幽靈工件", row.roll_id, row.raw)
+
+    holes = df[df["part"].isin((PART_KEYWAY, PART_INNER))]
+    for row in holes[~holes["roll_id"].isin(journal_finish_ids)].itertuples():
+        out.add(row.page, row.item, "依賴異常", "須有軸位再生", "缺軸位再生", row.roll_id, row.raw)
+
+
+def run_engineer_checks(parsed_pages):
+    """
+    回傳 {"issues": [...], "residual": [無法本地判定的資料描述], "checked_ids": 已本地檢查的編號數}
+    """
+    out = IssueCollector()
+    residual = []
+    for page in parsed_pages:
+        residual.extend(f"P.{page['page']} {line}" for line in page["unparsed"])
+
+    df = entries_frame(parsed_pages)
+    if df.empty:
+        return {"issues": [], "residual": residual, "checked_ids": 0}
+
+    unknown = df[(df["part"].isin(TRACKED_PARTS) & df["stage"].isna()) | df["part"].isna()]
+    residual.extend(f"P.{r.page} {r.item} | {r.roll_id} | {r.raw} (無法判斷部位/製程)" for r in unknown.itertuples())
+
+    wide = build_stage_table(df)
+    if wide is not None:
+        _check_interlock(wide, out)
+        _check_size_order(wide, out, residual)
+    _check_dependencies(df, out)
+
+    return {"issues": out.issues(), "residual": residual, "checked_ids": int(df["roll_id"].nunique())}
@@ -0,0 +1,131 @@
+"""
+自動模型路由 (Flash 先跑，必要時只把受影響的項目交給 Pro 複核)
+
+大部分工令都是乾淨的，每次都用 Pro 等於每次都付 Pro 的延遲。
+auto 模式先用 Flash 跑整份，以下情況才升級：
+- Flash 回應格式錯誤 (整份改送 Pro)；
+- Flash 回報異常 (只把該項目相關的頁面/編號送 Pro 複核，Pro 的判定取代 Flash)；
+- Flash 的結論與本地引擎已判定的結果衝突 (例如本地已核過的編號又被報流程異常)。
+這裡只放判斷與資料篩選 (不呼叫 Gemini)，實際呼叫在 audit_core。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from table_parser import strip_name, normalize_roll_id
+from incremental import filter_extracted_data
+
+MODEL_AUTO = "auto"
+MODEL_PRO = "models/gemini-2.5-pro"
+MODEL_FLASH = "models/gemini-2.5-flash"
+MODEL_LABELS = {MODEL_PRO: "Pro", MODEL_FLASH: "Flash"}
+
+EXCEL_MARK = "(📚Excel)"
+# 本地引擎已完整處理的問題類型 (Flash 對已核過的編號/項目回報這些 = 與本地結果衝突)
+LOCAL_ISSUE_TYPES = {
+    "engineer": ("流程", "尺寸", "依賴"),
+    "accountant": ("數量", "統計", "編號重複", "跨頁"),
+}
+JOB_NO_ITEM = "工令編號"
+REASON_LABELS = {"schema": "格式錯誤", "issue": "回報異常", "local_conflict": "與本地結果衝突"}
+
+# Pro 延遲估計 (秒 / 1k 輸入 Token)，用實際呼叫持續修正，只用來估算省下的時間
+PRO_SEC_PER_1K_TOKENS = float(os.environ.get("PRO_SEC_PER_1K_TOKENS", "4.0"))
+_pro_rate = PRO_SEC_PER_1K_TOKENS
+_rate_lock = threading.Lock()
+
+
+def model_label(model_name):
+    return MODEL_LABELS.get(model_name, model_name.rsplit("/", 1)[-1])
+
+
+def item_key(item_name):
+    """比對用的項目名稱 (去掉 Excel 標記、空白與全形差異)"""
+    return strip_name((item_name or "").replace(EXCEL_MARK, ""))
+
+
+def _issue_ids(issue):
+    return {normalize_roll_id(str(f.get("id", ""))) for f in issue.get("failures") or []} - {None}
+
+
+def _local_scope(parsed_pages, local_result):
+    """本地引擎已判定的 (編號, 項目)：有解析到、且沒出現在 residual 的部分"""
+    residual = "\n".join(local_result["residual"]) if local_result else ""
+    ids = {e["roll_id"] for p in parsed_pages for e in p["entries"] if e["roll_id"] not in residual}
+    items = {item_key(i["item"]) for p in parsed_pages for i in p["items"] if i["item"] not in residual}
+    return ids, items
+
+
+def escalation_reasons(result, agent, parsed_pages, local_result):
+    """
+    回傳 {項目key: "issue" | "local_conflict"} (依 Flash 回報順序)；空的代表不需要升級。
+    格式錯誤由呼叫端判斷 (整份升級)。
+    """
+    reasons = OrderedDict()
+    local_ids, local_items = _local_scope(parsed_pages, local_result) if local_result else (set(), set())
+    local_types = LOCAL_ISSUE_TYPES.get(agent, ())
+    for issue in result.get("issues", []):
+        key = item_key(issue.get("item"))
+        ids = _issue_ids(issue)
+        judged_locally = bool(ids) and ids <= local_ids if agent == "engineer" else key in local_items
+        conflict = judged_locally and any(t in str(issue.get("issue_type", "")) for t in local_types)
+        if conflict or key not in reasons:
+            reasons[key] = "local_conflict" if conflict else "issue"
+    if agent == "accountant" and local_result and local_result.get("job_no") not in (None, "Unknown"):
+        if result.get("job_no") not in (None, local_result["job_no"]):
+            reasons[item_key(JOB_NO_ITEM)] = "local_conflict"
+    return reasons
+
+
+def escalation_data(extracted_data_list, parsed_pages, issues, keys):
+    """
+    Pro 複核只需要的資料：受影響編號的完整履歷 (跨頁) + 受影響項目所在的整頁。
+    """
+    ids, pages = set(), set()
+    for issue in issues:
+        if item_key(issue.get("item")) not in keys: continue
+        ids |= _issue_ids(issue)
+        if str(issue.get("page", "")).isdigit(): pages.add(int(issue["page"]))
+    for page in parsed_pages:
+        if any(item_key(i["item"]) in keys for i in page["items"]): pages.add(page["page"])
+    if item_key(JOB_NO_ITEM) in keys:
+        pages |= {d["page"] for d in extracted_data_list}  # 表頭問題要看所有頁
+
+    by_page = {d["page"]: d for d in filter_extracted_data(extracted_data_list, ids)} if ids else {}
+    by_page.update({d["page"]: d for d in extracted_data_list if d["page"] in pages})
+    return [by_page[p] for p in sorted(by_page)]
+
+
+def subset_local_result(local_result, parsed_pages):
+    """複核子集只帶與子集編號/項目有關的 residual 行"""
+    if local_result is None: return None
+    names = {e["roll_id"] for p in parsed_pages for e in p["entries"]} | {i["item"] for p in parsed_pages for i in p["items"]}
+    return dict(local_result, residual=[l for l in local_result["residual"] if any(n in l for n in names)])
+
+
+def merge_routed(flash_result, pro_result, keys, whole=False):
+    """
+    Flash 結果去掉升級的項目，接上 Pro 的判定；每筆問題標註回答的模型。
+    whole=True (Flash 格式錯誤整份升級) 時直接採用 Pro。
+    """
+    pro_issues = [dict(i, model=model_label(MODEL_PRO)) for i in pro_result.get("issues", [])]
+    if whole:
+        merged = dict(pro_result, issues=pro_issues)
+    else:
+        kept = [dict(i, model=model_label(MODEL_FLASH)) for i in flash_result.get("issues", []) if item_key(i.get("item")) not in keys]
+        merged = dict(flash_result, issues=kept + pro_issues)
+        if item_key(JOB_NO_ITEM) in keys and "job_no" in pro_result: merged["job_no"] = pro_result["job_no"]
+    merged.pop("_from_cache", None)
+    return merged
+
+
+def record_pro_latency(seconds, tokens):
+    global _pro_rate
+    if tokens <= 0 or seconds <= 0: return
+    with _rate_lock:
+        _pro_rate = 0.7 * _pro_rate + 0.3 * (seconds / tokens * 1000)
+
+
+def estimate_pro_latency(tokens):
+    with _rate_lock:
+        return _pro_rate * tokens / 1000
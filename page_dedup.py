@@ -0,0 +1,109 @@
+"""
+重複頁面偵測 (同一頁拍兩次 / 重複上傳)
+
+- 檔案層：bytes 完全相同 (重複上傳) 直接排除，不送 OCR；
+- 影像層：dHash (16x16 差異雜湊，256 bits) 幾乎相同只算「疑似重複」——同一張表單格式的不同頁
+  (格線一樣、只有編號與數值不同) 雜湊也只差 0~1 bit，不能單憑影像排除，仍要送 OCR；
+- 文字層：OCR 後比對 full_text (字元相似度夠高，且編號/實測值完全相同) 才確定是重複，不送進 Prompt。
+  只差一個實測值也算不同頁 (OCR 誤讀一位數時兩頁都保留：會計師會多算，但不會默默少一頁資料)。
+重複頁會讓會計師把數量算兩次，所以預設排除；誤判會讓整頁資料消失，所以只有確定的才排除。
+"""
+import functools
+import io
+import re
+
+from PIL import Image, ImageOps
+
+HASH_SIZE = 16
+IMAGE_DUP_MAX_DISTANCE = 10   # 256 bits 中最多幾個 bit 不同 (約 4%)
+TEXT_DUP_MIN_SIMILARITY = 0.85  # 同頁重拍的 OCR 雜訊約 0.9；不同頁實測約 0.35
+SHINGLE_SIZE = 5
+# 在原始文字上切 (不能先去空白，否則相鄰儲存格會黏成 "Y5612001296")；前面不能接英數字或小數點
+NUMBER_RE = re.compile(r"(?<![A-Z0-9.])[A-Z]{0,3}\d[\d.\-]*")
+
+
+def image_hash(file_bytes):
+    """dHash：縮成 (N+1)xN 灰階，比較左右相鄰像素亮度；回傳 16 進位字串 (無法開啟的檔案回傳 None)"""
+    try:
+        image = Image.open(io.BytesIO(file_bytes))
+        image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+        image = ImageOps.exif_transpose(image).convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    except Exception:
+        return None
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (HASH_SIZE + 1) + col + 1])
+    return f"{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def hamming(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+@functools.lru_cache(maxsize=1024)
+def _text_signature(text):
+    upper = text.upper()
+    # 字元相似度才去空白 (換角度重拍時 OCR 斷行/空白位置會變)
+    clean = "".join(upper.split())
+    shingles = frozenset(clean[i:i + SHINGLE_SIZE] for i in range(max(1, len(clean) - SHINGLE_SIZE + 1)))
+    numbers = tuple(sorted(NUMBER_RE.findall(upper)))
+    return shingles, numbers
+
+
+def _jaccard(a, b):
+    if not a and not b: return 1.0
+    return len(a & b) / len(a | b)
+
+
+def text_similarity(text_a, text_b):
+    """全文字元相似度 (Jaccard)；編號/實測值 (含出現次數) 不完全相同時為 0"""
+    shingles_a, numbers_a = _text_signature(text_a)
+    shingles_b, numbers_b = _text_signature(text_b)
+    if numbers_a != numbers_b: return 0.0
+    return _jaccard(shingles_a, shingles_b)
+
+
+def _image_close(hash_a, hash_b):
+    return bool(hash_a and hash_b) and hamming(hash_a, hash_b) <= IMAGE_DUP_MAX_DISTANCE
+
+
+def find_duplicates(image_hashes, texts=None, keys=None):
+    """
+    確定的重複頁。image_hashes / texts / keys (內容雜湊)：依頁序排列，沒有資料的頁放 None。
+    回傳 {重複頁索引: (第一次出現的頁索引, "檔案" | "影像+文字" | "文字")}；每頁只跟前面「非重複」的頁比對。
+    影像雜湊相近但還沒有 OCR 全文的頁不算重複 (見 find_candidates)。
+    """
+    count = max(len(image_hashes), len(texts or []), len(keys or []))
+    image_hashes = list(image_hashes) or [None] * count
+    texts = texts or [None] * count
+    keys = keys or [None] * count
+    duplicates, originals = {}, []
+    for i in range(count):
+        for j in originals:
+            if keys[i] and keys[i] == keys[j]:
+                duplicates[i] = (j, "檔案")
+                break
+            if texts[i] and texts[j] and text_similarity(texts[i], texts[j]) >= TEXT_DUP_MIN_SIMILARITY:
+                duplicates[i] = (j, "影像+文字" if _image_close(image_hashes[i], image_hashes[j]) else "文字")
+                break
+        else:
+            originals.append(i)
+    return duplicates
+
+
+def find_candidates(image_hashes, duplicates=(), texts=None):
+    """
+    影像雜湊相近、但還沒確定是否重複的頁 {頁索引: 相近的頁索引} (只供提示，不排除)。
+    兩頁都有 OCR 全文時已經由 find_duplicates 比對過，不再列出。
+    """
+    texts = texts or [None] * len(image_hashes)
+    candidates, originals = {}, []
+    for i, h in enumerate(image_hashes):
+        if i in duplicates: continue
+        match = next((j for j in originals if _image_close(h, image_hashes[j]) and not (texts[i] and texts[j])), None)
+        if match is None: originals.append(i)
+        else: candidates[i] = match
+    return candidates
@@ -0,0 +1,148 @@
+"""
+相簿頁面的暫存檔與縮圖 (session 只保留雜湊，不保留原始影像)
+
+原本每頁的 UploadedFile、OCR 全文都掛在 session_state 裡直到清除，
+每次 rerun 還用原始解析度畫 4 欄縮圖；30 頁的工令加上多人同時使用，記憶體與頁面傳輸量都很大。
+- PageStore：影像以內容雜湊為檔名存到暫存目錄 (多個 session 上傳同一張只存一份)，
+  縮圖第一次需要時產生一次並存在旁邊，之後每次 rerun 都直接讀小檔；
+- SessionMemory：每個 session 的記憶體快取 (縮圖、OCR 全文) 有上限，超過就淘汰最久沒用的，
+  被淘汰的資料之後從磁碟重新讀取。
+"""
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+from disk_cache import atomic_write
+
+PAGE_STORE_DIR = os.environ.get("PAGE_STORE_DIR", os.path.join(tempfile.gettempdir(), "audit_pages"))
+PAGE_STORE_TTL_HOURS = float(os.environ.get("PAGE_STORE_TTL_HOURS", "24"))  # 超過這麼久沒讀取就刪除
+CLEANUP_INTERVAL_SECONDS = 3600
+THUMB_EDGE = 360        # 4 欄網格在手機上每格不到 200px，留 2 倍給高解析度螢幕
+THUMB_QUALITY = 70
+SESSION_MEMORY_MB = int(os.environ.get("SESSION_MEMORY_MB", "8"))
+
+
+def page_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_thumbnail(data):
+    """縮成長邊 THUMB_EDGE 的 JPEG；無法開啟的檔案回傳 None"""
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft("RGB", (THUMB_EDGE, THUMB_EDGE))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((THUMB_EDGE, THUMB_EDGE), Image.LANCZOS)
+        out = io.BytesIO()
+        image.convert("L" if image.mode in ("L", "LA", "1") else "RGB").save(out, "JPEG", quality=THUMB_QUALITY)
+        return out.getvalue()
+    except Exception:
+        return None
+
+
+class PageStore:
+    def __init__(self, root, ttl_hours=PAGE_STORE_TTL_HOURS):
+        self.root = root
+        self.ttl = ttl_hours * 3600
+        self._last_cleanup = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key, suffix=".bin"):
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def put(self, data):
+        """存入並回傳雜湊鍵 (已存在就只更新使用時間)"""
+        key = page_key(data)
+        path = self._path(key)
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            atomic_write(path, data)
+        self._maybe_cleanup()
+        return key
+
+    def get(self, key):
+        """原始 bytes；已被清掉時回傳 None"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f: data = f.read()
+        except FileNotFoundError:
+            return None
+        try: os.utime(path, None)
+        except OSError: pass
+        return data
+
+    def thumbnail(self, key):
+        """縮圖 JPEG bytes，只在第一次需要時產生"""
+        path = self._path(key, ".thumb.jpg")
+        try:
+            with open(path, "rb") as f: return f.read()
+        except FileNotFoundError:
+            pass
+        data = self.get(key)
+        thumb = make_thumbnail(data) if data else None
+        if thumb: atomic_write(path, thumb)
+        return thumb
+
+    def _maybe_cleanup(self):
+        with self._lock:
+            if time.time() - self._last_cleanup < CLEANUP_INTERVAL_SECONDS: return
+            self._last_cleanup = time.time()
+        cutoff = time.time() - self.ttl
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff: os.remove(path)
+                except OSError:
+                    continue  # 其他 session 剛好刪掉
+
+
+class SessionMemory:
+    """以位元組計量的 LRU：get(key, loader) 沒有就呼叫 loader() 載入 (None 不快取)"""
+    def __init__(self, max_bytes=SESSION_MEMORY_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        value = loader()
+        if value is None: return None
+        size = sys.getsizeof(value)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self.used += size
+            while self.used > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.used -= evicted
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.used}
+
+
+# 行程內共用 (所有 Streamlit session)
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_page_store():
+    global _store
+    with _store_lock:
+        if _store is None: _store = PageStore(PAGE_STORE_DIR)
+    return _store
@@ -0,0 +1,142 @@
+"""
+Gemini 輸入精簡 (Compact IR + 依 Token 預算序列化)
+
+原本 combined_input 直接串接每頁完整的 pipe 表格 + 800 字頁首，兩個 Agent 收到同一份。
+這裡先把表格轉成精簡的中間表示：
+- 刪除整欄空白的欄位、重複出現的表頭列；
+- 上方統計表格 (每頁都印一次) 整份工令只送一次；
+再依 Agent 只保留相關欄位，並在超過 Token 預算時逐步壓縮頁首。
+"""
+import re
+
+from table_parser import split_markdown_tables, normalize_number, normalize_roll_id, is_item_cell
+from local_accountant import parse_header
+from tracing import span
+
+# 各 Agent 不需要的欄位 (依表頭文字判斷)
+AGENT_DROP_COLUMNS = {
+    "engineer": ("單位", "數量", "單價", "金額", "預定", "實交"),
+    "accountant": ("單價", "金額"),
+}
+# 頁首壓縮階段：None = 原樣；數字 = 截斷長度；"fields" = 只留工令編號/日期
+HEADER_STEPS = (None, 400, 200, "fields")
+CJK_RE = re.compile(r"[　-鿿＀-￯]")
+
+
+def estimate_tokens(text):
+    """粗估 Token 數：中日韓字元約 1 字 1 token，其餘約 4 字元 1 token"""
+    if not text: return 0
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def build_raw_input(extracted_data_list):
+    """舊版 combined_input (用來比較精簡前後的 Token 數)"""
+    combined_input = "以下是各頁資料：\n"
+    for data in extracted_data_list:
+        combined_input += f"\n=== Page {data['page']} ===\n【頁首】:\n{data['header_text']}\n【表格】:\n{data['table']}\n"
+    return combined_input
+
+
+def _is_header_row(cells):
+    return any(c for c in cells) and not any(
+        normalize_number(c) is not None or normalize_roll_id(c) or is_item_cell(c) for c in cells if c)
+
+
+def _is_summary_table(rows):
+    # 有編號就是明細 (明細表頭也可能是「預定數量 | 實交數量」，誤判會讓工程師整張表看不到)
+    if any(normalize_roll_id(c) for cells in rows for c in cells): return False
+    if any("實交" in c or "預定" in c for cells in rows for c in cells): return True
+    return any(is_item_cell(c) for cells in rows for c in cells)
+
+
+def compact_table(rows):
+    """刪除整欄空白的欄位；回傳 (表頭列, 資料列)"""
+    width = max((len(r) for r in rows), default=0)
+    rows = [r + [""] * (width - len(r)) for r in rows]
+    keep = [c for c in range(width) if any(r[c] for r in rows)]
+    rows = [[r[c] for c in keep] for r in rows]
+    header = rows[0] if rows and _is_header_row(rows[0]) else None
+    return header, (rows[1:] if header else rows)
+
+
+def build_job_ir(extracted_data_list):
+    """
+    回傳每頁的精簡表示：
+    [{"page", "header_text", "header_fields", "tables": [{"kind", "header", "rows", "dup_of"}]}]
+    """
+    ir = []
+    seen_tables = {}
+    for data in extracted_data_list:
+        page = {"page": data["page"], "header_text": data.get("header_text") or "",
+                "header_fields": parse_header(data.get("header_text")), "tables": []}
+        for _, rows in split_markdown_tables(data.get("table")):
+            header, body = compact_table(rows)
+            kind = "summary" if _is_summary_table(rows) else "detail"
+            signature = (kind, tuple(header or ()), tuple(tuple(r) for r in body))
+            page["tables"].append({"kind": kind, "header": header, "rows": body,
+                                   "dup_of": seen_tables.get(signature)})
+            seen_tables.setdefault(signature, data["page"])
+        ir.append(page)
+    return ir
+
+
+def _select_columns(header, rows, agent):
+    drop = AGENT_DROP_COLUMNS.get(agent, ())
+    if not header or not drop: return header, rows
+    keep = [i for i, h in enumerate(header) if not any(d in h for d in drop)]
+    # 編號/實測值列的欄位和表頭不一定對齊，只對沒有編號的列刪欄
+    selected = []
+    for r in rows:
+        if any(normalize_roll_id(c) for c in r): selected.append(r)
+        else: selected.append([r[i] for i in keep if i < len(r)])
+    return [header[i] for i in keep], selected
+
+
+def _format_header(page, step):
+    if step is None: return page["header_text"]
+    if step == "fields":
+        return " ".join(f"{k}={v}" for k, v in page["header_fields"].items()) or page["header_text"][:100]
+    return page["header_text"][:step]
+
+
+def _serialize(ir, agent, header_step):
+    lines = ["以下是各頁資料 (表格以 | 分隔，已省略空白欄與重複表頭)："]
+    seen_headers = set()
+    for page in ir:
+        lines.append(f"=== Page {page['page']} ===")
+        # 工程師不檢查表頭，不送頁首
+        if agent != "engineer":
+            lines.append("【頁首】" + " ".join(_format_header(page, header_step).split()))
+        for t_idx, table in enumerate(page["tables"], start=1):
+            # 工程師不看統計表格；統計表格整份工令只送一次
+            if table["kind"] == "summary" and agent == "engineer": continue
+            if table["dup_of"] is not None:
+                lines.append(f"【表{t_idx}】(同 Page {table['dup_of']})")
+                continue
+            header, rows = _select_columns(table["header"], table["rows"], agent)
+            lines.append(f"【表{t_idx}{'・統計' if table['kind'] == 'summary' else ''}】")
+            if header and tuple(header) not in seen_headers:
+                seen_headers.add(tuple(header))
+                lines.append("|".join(header))
+            lines.extend("|".join(r) for r in rows if any(r))
+    return "\n".join(lines)
+
+
+def serialize_for_agent(ir, agent, token_budget=None):
+    """
+    依 Agent 產生精簡輸入；超過 token_budget 時逐步壓縮頁首。
+    回傳 (文字, {"tokens", "over_budget"})
+    """
+    with span("prompt_assembly", agent=agent, pages=len(ir), token_budget=token_budget) as s:
+        text = ""
+        for step in HEADER_STEPS:
+            text = _serialize(ir, agent, step)
+            tokens = estimate_tokens(text)
+            if token_budget is None or tokens <= token_budget:
+                s.set(tokens=tokens, header_step=step)
+                return text, {"tokens": tokens, "over_budget": False}
+        # 表格資料不能丟，壓到最小仍超過預算就照送並回報
+        tokens = estimate_tokens(text)
+        s.set(tokens=tokens, over_budget=True)
+        return text, {"tokens": tokens, "over_budget": True}
@@ -0,0 +1,136 @@
+"""
+Excel 規則索引 (Aho–Corasick 多關鍵字自動機)
+
+rules.xlsx 只在檔案 mtime 變動時重新讀取並編譯；比對時對「去空白」的 OCR 全文
+只掃描一次，就能找出所有命中的 Item_Name，成本與規則數量無關。
+"""
+import hashlib
+import os
+import threading
+from collections import deque
+
+import pandas as pd
+
+# 以模組所在目錄為準 (批次 CLI 從其他目錄執行時也找得到規則檔)
+RULES_PATH = os.environ.get("RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.xlsx"))
+
+
+def strip_spaces(text):
+    # 移除所有空格、換行 (Azure 可能把 "W3#6" 讀成 "W3 \n #6")
+    return "".join(str(text).split())
+
+
+def _cell(row, name):
+    value = row.get(name, '')
+    if pd.isna(value): return ''
+    return str(value).strip()
+
+
+class RuleIndex:
+    def __init__(self, rules):
+        """rules: [(Item_Name, Standard_Spec, Category), ...]，依 Excel 列順序"""
+        self.rules = rules
+        self.rule_descs = [f"- 項目: {keyword} | 類別: {category} | 規範: {spec}" for keyword, spec, category in rules]
+
+        # goto[state] = {字元: 下一個 state}；out[state] = 在此 state 結束的 pattern 編號
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._pattern_rows = []  # pattern 編號 -> 對應的 Excel 列 (同一關鍵字可能有多列)
+
+        pattern_ids = {}
+        for row_idx, (keyword, _, _) in enumerate(rules):
+            keyword_clean = strip_spaces(keyword)
+            if not keyword_clean: continue
+            if keyword_clean not in pattern_ids:
+                pattern_ids[keyword_clean] = len(self._pattern_rows)
+                self._pattern_rows.append([])
+                self._add_pattern(keyword_clean, pattern_ids[keyword_clean])
+            self._pattern_rows[pattern_ids[keyword_clean]].append(row_idx)
+        self._build_failure_links()
+
+    def _add_pattern(self, pattern, pattern_id):
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][ch] = nxt
+            state = nxt
+        self._out[state].append(pattern_id)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                # 合併後綴的輸出，掃描時不必再沿 fail 鏈找
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def match_rows(self, text_clean):
+        """回傳命中的 Excel 列索引 (依原始列順序)"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        found = set()
+        for ch in text_clean:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]: found.update(out[state])
+        rows = []
+        for pattern_id in found: rows.extend(self._pattern_rows[pattern_id])
+        return sorted(rows)
+
+    def match(self, ocr_text):
+        """回傳命中規則的描述字串列表 (格式與舊版 get_dynamic_rules 相同)"""
+        return [self.rule_descs[i] for i in self.match_rows(strip_spaces(ocr_text))]
+
+
+def build_rule_index(path):
+    df = pd.read_excel(path)
+    # 防呆：去除欄位名稱的前後空白 (避免 Excel 標題多了空格導致讀不到)
+    df.columns = [str(c).strip() for c in df.columns]
+    rules = []
+    for row in df.to_dict("records"):
+        rules.append((_cell(row, 'Item_Name'), _cell(row, 'Standard_Spec'), _cell(row, 'Category')))
+    return RuleIndex(rules)
+
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+def load_rule_index(path=RULES_PATH):
+    """依檔案 mtime 快取編譯好的索引，Excel 更新後下一次呼叫自動重建"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _index_cache.get(path)
+    if cached and cached[0] == mtime: return cached[1]
+    with _index_lock:
+        cached = _index_cache.get(path)
+        if cached and cached[0] == mtime: return cached[1]
+        index = build_rule_index(path)
+        _index_cache[path] = (mtime, index)
+        return index
+
+
+_version_cache = {}
+
+def rules_version(path=RULES_PATH):
+    """規則檔內容雜湊 (依 mtime 快取)；沒有規則檔時為 None。增量稽核用它判斷上一次的 Gemini 結果能否沿用"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _version_cache.get(path)
+    if cached and cached[0] == mtime: return cached[1]
+    with open(path, "rb") as f:
+        version = hashlib.sha256(f.read()).hexdigest()
+    _version_cache[path] = (mtime, version)
+    return version
@@ -0,0 +1,80 @@
+"""
+串流 JSON 的增量解析 (Gemini 邊生成邊送出時，先把已經完整的 issues[] 元素交給畫面)
+
+Agent 回應格式固定是 {"issues": [{...}, {...}], ...}。
+這裡只追蹤字串/跳脫字元與括號深度：頂層物件的 "issues" 陣列中，每個元素的右括號一出現
+就解析該元素並回傳，不必等整份 JSON 結束。完整結果仍以串流結束後的 json.loads 為準
+(被截斷或格式錯誤時，已送出的元素只是預覽，不會寫入快取)。
+"""
+import json
+
+
+class IssueStreamParser:
+    def __init__(self, key="issues"):
+        self.key = key
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._current_key = None
+        self._in_array = False
+        self._element_start = None
+
+    def feed(self, chunk):
+        """加入新的片段，回傳這次新完成的元素 (dict) 清單"""
+        self.text += chunk
+        completed = []
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            ch = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:  # 只有頂層物件的字串可能是要找的 key
+                        self._last_string = text[self._string_start:pos + 1]
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif ch == ":" and self._depth == 1:
+                self._current_key = self._decode_key(self._last_string)
+            elif ch == "," and self._depth == 1:
+                self._current_key = None
+            elif ch in "{[":
+                if ch == "[" and self._depth == 1 and self._current_key == self.key:
+                    self._in_array = True
+                elif ch == "{" and self._in_array and self._depth == 2:
+                    self._element_start = pos
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._in_array and self._depth == 2 and self._element_start is not None:
+                    element = self._parse(text[self._element_start:pos + 1])
+                    if element is not None: completed.append(element)
+                    self._element_start = None
+                elif self._in_array and self._depth == 1:
+                    self._in_array = False
+        self._pos = len(text)
+        return completed
+
+    @staticmethod
+    def _decode_key(raw):
+        try:
+            return json.loads(raw) if raw else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _parse(raw):
+        try:
+            element = json.loads(raw)
+        except ValueError:
+            return None
+        return element if isinstance(element, dict) else None
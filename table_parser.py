@@ -0,0 +1,175 @@
+"""
+OCR 表格解析 (table_md -> 結構化資料)
+
+把 extract_layout_with_azure 產生的 pipe 表格拆回「項目 / 滾輪編號 / 實測值」，
+並依項目名稱判斷部位 (本體、軸頸…) 與製程階段 (未再生、銲補…)。
+無法確定歸屬的列會放進 unparsed，交給 Gemini 處理。
+"""
+import re
+
+import pandas as pd
+
+# 項目名稱關鍵字 (出現任一個就視為「項目」儲存格)
+ITEM_KEYWORDS = ("車修", "銲補", "研磨", "精車", "組裝", "拆裝", "鍵槽", "KEYWAY", "內孔", "熱處理", "運費", "拆除", "ROLL", "輥輪")
+
+# 製程階段 (順序有意義：未再生 要比 再生 先判斷)
+STAGE_PRE, STAGE_WELD, STAGE_FINISH, STAGE_GRIND = "未再生", "銲補", "再生車修", "研磨"
+STAGE_ORDER = (STAGE_PRE, STAGE_GRIND, STAGE_FINISH, STAGE_WELD)  # 尺寸由小到大
+
+PART_BODY, PART_JOURNAL = "本體", "軸頸"
+PART_KEYWAY, PART_INNER, PART_ASSEMBLY, PART_HEAT = "Keyway", "內孔", "組裝/拆裝", "熱處理"
+STANDALONE_PARTS = (PART_KEYWAY, PART_INNER, PART_ASSEMBLY)
+
+TABLE_TITLE_RE = re.compile(r"^###\s*Table\s+(\d+)")
+ROLL_ID_RE = re.compile(r"^[A-Z]{1,3}\d[A-Z0-9\-]*$")
+NUMBER_RE = re.compile(r"^[+-]?\d+(\.\d+)?$")
+ID_VALUE_RE = re.compile(r"^([A-Z]{1,3}\d[A-Z0-9\-]*)\s*[:：=]?\s*([+-]?\d+(?:\s*\.\s*\d+)?)$")
+# 機台/規格字樣，長得像編號但不是 (例如 W3、R0LLER)
+NOT_ROLL_ID_RE = re.compile(r"^(W\d{1,3}|#\d+)$")
+
+
+def strip_name(text):
+    """項目名稱比對用：去空白、轉大寫、全形括號/等號轉半形"""
+    name = "".join(str(text).split()).upper()
+    return name.replace("（", "(").replace("）", ")").replace("＝", "=")
+
+
+def normalize_number(text):
+    """'341 . 12' -> '341.12'；不是數字回傳 None"""
+    if text is None: return None
+    compact = "".join(str(text).split()).replace("，", ".").replace(",", ".")
+    return compact if NUMBER_RE.match(compact) else None
+
+
+def normalize_roll_id(text):
+    compact = "".join(str(text).split()).upper()
+    if not ROLL_ID_RE.match(compact) or NOT_ROLL_ID_RE.match(compact): return None
+    return compact
+
+
+def is_item_cell(text):
+    upper = str(text).upper()
+    return len(upper) >= 4 and any(k in upper for k in ITEM_KEYWORDS)
+
+
+def classify_item(item_name):
+    """回傳 (部位, 製程階段)；判斷不出來的欄位為 None"""
+    name = strip_name(item_name)
+    if "熱處理" in name: return PART_HEAT, None
+    if "組裝" in name or "拆裝" in name: return PART_ASSEMBLY, None
+    if "KEYWAY" in name or "鍵槽" in name: return PART_KEYWAY, None
+    if "內孔" in name: return PART_INNER, None
+
+    if "本體" in name or "BODY" in name or "V型槽" in name: part = PART_BODY
+    elif "軸頸" in name or "軸位" in name or "主動軸" in name or "從動軸" in name: part = PART_JOURNAL
+    else: part = None
+
+    if "未再生" in name: stage = STAGE_PRE
+    elif "銲補" in name: stage = STAGE_WELD
+    elif "研磨" in name: stage = STAGE_GRIND
+    elif "再生" in name or "精車" in name: stage = STAGE_FINISH
+    else: stage = None
+    return part, stage
+
+
+def split_markdown_tables(table_md):
+    """回傳 [(table_no, [row_cells, ...]), ...]"""
+    tables = []
+    current = None
+    for line in (table_md or "").splitlines():
+        line = line.strip()
+        title = TABLE_TITLE_RE.match(line)
+        if title:
+            current = (int(title.group(1)), [])
+            tables.append(current)
+            continue
+        if not line.startswith("|"): continue
+        if current is None:
+            current = (1, [])
+            tables.append(current)
+        current[1].append([c.strip() for c in line.strip("|").split("|")])
+    return tables
+
+
+def _row_pairs(cells):
+    """找出一列中的 (編號, 原始值) 配對，回傳 (pairs, 是否有落單的編號)"""
+    pairs, orphan = [], False
+    i = 0
+    while i < len(cells):
+        roll_id = normalize_roll_id(cells[i])
+        if roll_id:
+            value = normalize_number(cells[i + 1]) if i + 1 < len(cells) else None
+            if value is not None:
+                pairs.append((roll_id, value))
+                i += 2
+                continue
+            orphan = True
+        else:
+            # 同一格內 "Y5612001 298" 的寫法
+            combined = ID_VALUE_RE.match(cells[i].strip().upper())
+            if combined and normalize_roll_id(combined.group(1)):
+                pairs.append((normalize_roll_id(combined.group(1)), normalize_number(combined.group(2))))
+        i += 1
+    return pairs, orphan
+
+
+def parse_table_md(table_md, page):
+    """
+    解析單頁 table_md。
+    回傳 {"page", "items": [{"item", "part", "stage", "qty", "table", "page", "has_entries"}],
+          "entries": [{"page", "item", "part", "stage", "roll_id", "raw", "value"}],
+          "unparsed": [原始列文字]}
+    """
+    items, entries, unparsed = [], [], []
+    for table_no, rows in split_markdown_tables(table_md):
+        current_item = None
+        qty_col = None
+        for cells in rows:
+            item_idx = next((i for i, c in enumerate(cells) if is_item_cell(c)), None)
+            if item_idx is None and qty_col is None:
+                # 表頭列：記住「實交數量」(沒有就用「數量」) 的欄位位置
+                qty_col = next((i for i, c in enumerate(cells) if "實交" in c), None)
+                if qty_col is None: qty_col = next((i for i, c in enumerate(cells) if "數量" in c), None)
+            if item_idx is not None:
+                name = cells[item_idx]
+                part, stage = classify_item(name)
+                qty = normalize_number(cells[qty_col]) if qty_col is not None and qty_col < len(cells) else None
+                if qty is None:
+                    # 項目名稱後、第一個編號前的純數字欄位視為該項目數量
+                    for c in cells[item_idx + 1:]:
+                        if normalize_roll_id(c): break
+                        if normalize_number(c) is not None:
+                            qty = normalize_number(c)
+                            break
+                current_item = {"item": name, "part": part, "stage": stage, "qty": qty, "table": table_no, "page": page, "has_entries": False}
+                items.append(current_item)
+                cells = cells[:item_idx] + cells[item_idx + 1:]
+
+            pairs, orphan = _row_pairs(cells)
+            if pairs and current_item is None:
+                orphan = True
+            elif pairs:
+                current_item["has_entries"] = True
+                for roll_id, raw in pairs:
+                    entries.append({
+                        "page": page, "item": current_item["item"], "part": current_item["part"],
+                        "stage": current_item["stage"], "roll_id": roll_id, "raw": raw, "value": float(raw),
+                    })
+            if orphan:
+                unparsed.append("| " + " | ".join(cells) + " |")
+    return {"page": page, "items": items, "entries": entries, "unparsed": unparsed}
+
+
+def parse_pages(extracted_data_list):
+    """extracted_data_list: [{"page", "table", "header_text"}, ...]"""
+    return [parse_table_md(d.get("table"), d.get("page")) for d in extracted_data_list]
+
+
+ENTRY_COLUMNS = ["page", "item", "part", "stage", "roll_id", "raw", "value"]
+
+def entries_frame(parsed_pages):
+    """所有頁面的實測資料攤平成一張 DataFrame (欄式)"""
+    rows = [e for p in parsed_pages for e in p["entries"]]
+    df = pd.DataFrame(rows, columns=ENTRY_COLUMNS)
+    df["is_integer"] = ~df["raw"].astype(str).str.contains(".", regex=False)
+    return df
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# 模組都放在專案根目錄 (不是套件)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def trace_sink(tmp_path):
+    """測試產生的 Span 寫到暫存目錄，不要寫進專案的 .traces/"""
+    path = str(tmp_path / "spans.jsonl")
+    tracing.set_sink(path)
+    yield path
+    tracing.set_sink(tracing.TRACE_FILE or None)
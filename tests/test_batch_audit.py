@@ -0,0 +1,42 @@
+import json
+import os
+
+import audit_core
+import batch_audit
+from rule_index import RULES_PATH
+
+SETTINGS = {"doc_endpoint": "", "doc_key": "", "gemini_key": "", "eng_model": "auto", "acc_model": "auto",
+            "ocr_workers": 1, "token_budget": None, "ocr_bundle": True, "prep_images": False, "shard_max_ids": 40}
+
+
+def fake_audit(failed_pages=(), failed_agents=()):
+    def audit_job(pages, *args, **kwargs):
+        return {"job_no": "1130512-01", "issues": [], "pages": len(pages), "audit_state": {},
+                "failed_pages": list(failed_pages), "failed_agents": list(failed_agents)}
+    return audit_job
+
+
+def run(tmp_path, monkeypatch, **failures):
+    page = tmp_path / "P1.jpg"
+    page.write_bytes(b"jpeg")
+    monkeypatch.setattr(audit_core, "audit_job", fake_audit(**failures))
+    return batch_audit._run_job("job", [str(page)], SETTINGS)
+
+
+def test_incomplete_jobs_are_partial_and_retried(tmp_path, monkeypatch):
+    ok = run(tmp_path, monkeypatch)
+    ocr_failed = run(tmp_path, monkeypatch, failed_pages=[{"page": 1, "error": "429"}])
+    agent_failed = run(tmp_path, monkeypatch, failed_agents=["engineer"])
+    assert [r["status"] for r in (ok, ocr_failed, agent_failed)] == ["ok", "partial", "partial"]
+
+    output = tmp_path / "results.jsonl"
+    records = [dict(ok, job_id="a"), dict(ocr_failed, job_id="b"), dict(agent_failed, job_id="c")]
+    output.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+    assert batch_audit.load_finished(str(output)) == {"a"}
+
+
+def test_rules_and_caches_do_not_depend_on_cwd():
+    root = os.path.dirname(os.path.abspath(audit_core.__file__))
+    assert os.path.isabs(RULES_PATH) and os.path.exists(RULES_PATH)
+    for path in (audit_core.OCR_CACHE_DIR, audit_core.LLM_CACHE_DIR):
+        assert os.path.isabs(path) and path.startswith(root)
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from disk_cache import DiskCache, atomic_write
+
+
+def files(root):
+    return sum(len([n for n in names if n.endswith(".json")]) for _, _, names in os.walk(root))
+
+
+def test_entry_cap_with_running_totals(tmp_path):
+    cache = DiskCache(str(tmp_path), max_entries=50)
+    for i in range(200):
+        cache.set(f"{i:064x}", {"n": i})
+        assert files(tmp_path) <= 50
+    assert cache._count == files(tmp_path)
+    assert cache.get(f"{199:064x}") == {"n": 199}
+
+
+def test_overwrite_does_not_count_twice(tmp_path):
+    cache = DiskCache(str(tmp_path), max_entries=10)
+    for _ in range(30):
+        cache.set("a" * 64, {"v": "x"})
+    assert cache._count == 1
+
+
+def test_atomic_write_leaves_no_temp_files(tmp_path):
+    path = tmp_path / "ab" / "page.bin"
+    atomic_write(str(path), b"one")
+    atomic_write(str(path), b"two")
+    assert path.read_bytes() == b"two"
+    with pytest.raises(TypeError):
+        atomic_write(str(path), "not bytes")
+    assert path.read_bytes() == b"two"
+    assert [p.name for p in path.parent.iterdir()] == ["page.bin"]
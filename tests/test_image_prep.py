@@ -0,0 +1,60 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from image_prep import _analysis_gray, estimate_skew, prepare_page
+
+
+def ruled_table(width=1700, height=2200, spacing=25):
+    """密集等距格線的表格 (舊的投影分數在這種版面會選到反方向)"""
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    rows = (height - 300) // spacing
+    for r in range(rows + 1):
+        draw.line((80, 150 + r * spacing, width - 80, 150 + r * spacing), fill=0, width=2)
+    for x in np.linspace(80, width - 80, 6):
+        draw.line((x, 150, x, 150 + rows * spacing), fill=0, width=2)
+    for r in range(rows):
+        draw.text((100, 150 + r * spacing + spacing // 3), f"Y56{r:05d}  296.52  297.{r % 100:02d}", fill=0)
+    return image
+
+
+@pytest.mark.parametrize("angle", [2.5, -2.5])
+def test_skew_on_ruled_table(angle):
+    tilted = ruled_table().rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    skew = estimate_skew(_analysis_gray(tilted))
+    # 轉正後殘餘角度 = 原傾斜 + 修正角度 (PIL 逆時針為正)
+    assert abs(angle + skew) <= 0.3
+
+
+def on_desk(page, angle, margin, desk):
+    """照片：紙張轉 angle 度後放在灰色桌面上 (旋轉露出的角落也是桌面色)"""
+    rotated = page.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=desk)
+    photo = Image.new("L", (rotated.width + 2 * margin, rotated.height + 2 * margin), desk)
+    photo.paste(rotated, (margin, margin))
+    return photo
+
+
+@pytest.mark.parametrize("angle,margin,desk", [(2.5, 100, 60), (-2.5, 300, 150), (2.5, 40, 150)])
+def test_skew_on_desk_background(angle, margin, desk):
+    skew = estimate_skew(_analysis_gray(on_desk(ruled_table(), angle, margin, desk)))
+    assert abs(angle + skew) <= 0.3
+
+
+def test_prepare_page_deskews_then_crops_photo():
+    output = io.BytesIO()
+    on_desk(ruled_table(), 2.5, 100, 90).convert("RGB").save(output, "JPEG", quality=90)
+    _, info = prepare_page(output.getvalue())
+    assert info["error"] is None
+    assert abs(info["skew"] + 2.5) <= 0.3
+    assert info["cropped"]
+
+
+def test_straight_table_is_not_rotated():
+    output = io.BytesIO()
+    ruled_table().save(output, "JPEG", quality=90)
+    _, info = prepare_page(output.getvalue())
+    assert info["error"] is None
+    assert info["skew"] == 0.0
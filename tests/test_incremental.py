@@ -0,0 +1,51 @@
+import os
+
+from incremental import build_audit_state, plan_delta, remap_result
+from rule_index import rules_version
+
+SETTINGS = ["flash", "flash", None, 40]
+
+
+def parsed(page, roll_id):
+    return {"page": page, "unparsed": [],
+            "items": [{"item": "本體未再生車修 (SET)"}],
+            "entries": [{"roll_id": roll_id}]}
+
+
+def state(fingerprints, pages, res_eng=None, res_acc=None):
+    return build_audit_state(fingerprints, pages, SETTINGS, res_eng or {"issues": []}, res_acc or {"issues": []}, [])
+
+
+def test_failed_results_are_not_kept_for_reuse():
+    pages = [parsed(1, "Y0001")]
+    assert state(["a"], pages, res_eng={"issues": [], "_failed": True}) is None
+    assert state(["a"], pages, res_acc={"job_no": "Error", "issues": [], "_failed": True}) is None
+    assert plan_delta(None, ["a"], pages, SETTINGS)["mode"] == "full"
+    assert plan_delta(state(["a"], pages), ["a"], pages, SETTINGS)["mode"] == "reuse"
+
+
+def test_page_map_uses_real_page_numbers():
+    # 舊相簿 [A, (OCR 失敗), C]；刪掉 A 後 C 從 P.3 變成 P.2
+    prev = state(["A", "C"], [parsed(1, "Y0001"), parsed(3, "Y0003")],
+                 res_eng={"issues": [{"page": "3", "item": "x", "failures": [{"id": "Y0003"}]}]})
+    plan = plan_delta(prev, ["C"], [parsed(2, "Y0003")], SETTINGS)
+    assert plan["mode"] == "delta"
+    assert plan["page_map"] == {"3": "2"}
+    assert remap_result(prev["res_eng"], plan["page_map"])["issues"][0]["page"] == "2"
+
+
+def test_rules_change_forces_full_rerun(tmp_path):
+    path = tmp_path / "rules.xlsx"
+    assert rules_version(str(path)) is None
+    path.write_bytes(b"v1")
+    v1 = rules_version(str(path))
+    path.write_bytes(b"v2")
+    os.utime(path, ns=(1, 1))  # 確保 mtime 不同 (快取依 mtime)
+    v2 = rules_version(str(path))
+    assert v1 != v2
+
+    pages = [parsed(1, "Y0001")]
+    prev = build_audit_state(["a"], pages, SETTINGS, {"issues": []}, {"issues": []}, ["P.1 殘留"], v1)
+    assert plan_delta(prev, ["a"], pages, SETTINGS, v1)["mode"] == "reuse"
+    assert plan_delta(prev, ["a"], pages, SETTINGS, v2)["mode"] == "full"
+    assert plan_delta(prev, ["a", "b"], pages + [parsed(2, "Y0002")], SETTINGS, v2)["mode"] == "full"
@@ -0,0 +1,46 @@
+import time
+
+from job_queue import DONE, ERROR, JobQueue
+
+
+def wait(queue, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in (DONE, ERROR): return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {job['status']}")
+
+
+def handler(pages, settings, on_progress, on_issue, prev_audit):
+    if settings.get("bad_result"): return {"value": object()}  # 無法轉 JSON
+    return {"pages": len(pages), "prev": prev_audit}
+
+
+def test_prev_audit_stored_outside_settings(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), handler, workers=1)
+    job_id = queue.submit([b"a", b"b"], {"mode": "x"}, prev_audit={"fingerprints": ["f1"]})
+    job = wait(queue, job_id)
+    assert job["status"] == DONE
+    assert job["settings"] == {"mode": "x"}
+    assert job["result"] == {"pages": 2, "prev": {"fingerprints": ["f1"]}}
+
+
+def test_worker_survives_failures_while_recording_errors(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), handler, workers=1)
+    original_update = queue._update
+    calls = {"error": 0}
+
+    def flaky_update(job_id, **fields):
+        # 第一次寫入錯誤狀態時資料庫「被鎖住」
+        if fields.get("status") == ERROR and not calls["error"]:
+            calls["error"] += 1
+            raise RuntimeError("database is locked")
+        original_update(job_id, **fields)
+
+    queue._update = flaky_update
+    bad = queue.submit([b"a"], {"bad_result": True})
+    good = queue.submit([b"b"], {})
+    failed = wait(queue, bad)
+    assert failed["status"] == ERROR and failed["error"].startswith("TypeError")
+    assert wait(queue, good)["status"] == DONE
@@ -0,0 +1,73 @@
+import json
+import os
+
+from azure.ai.documentintelligence.models import AnalyzeResult
+
+from audit_core import split_analyze_result
+from local_accountant import run_accountant_checks
+from table_parser import parse_pages
+
+FIXTURE = os.path.join(os.path.dirname(__file__), os.pardir, "bench", "fixtures", "analyze_result_page.json")
+
+
+def fixture_page(replace=None):
+    with open(FIXTURE, "r", encoding="utf-8") as f:
+        result = json.load(f)
+    table_md, header_text, _ = split_analyze_result(AnalyzeResult(result), 1)[0]
+    for old, new in (replace or {}).items():
+        assert old in table_md
+        table_md = table_md.replace(old, new)
+    data = [{"page": 1, "table": table_md, "header_text": header_text}]
+    return parse_pages(data), data
+
+
+def test_fixture_reconciles_with_unit_conversion():
+    # (SET) 1 = 2 支：車修 2+2+2+2 = 8、銲補 2；運費 本體未再生 1 SET x2 = 2
+    result = run_accountant_checks(*fixture_page())
+    assert result["issues"] == []
+    assert result["residual"] == []
+    assert result["job_no"] == "1130512-01"
+
+
+def test_summary_mismatch_reports_converted_total():
+    result = run_accountant_checks(*fixture_page({"| ROLL 車修 | PC | 8 | 8 |": "| ROLL 車修 | PC | 6 | 6 |"}))
+    assert [(i["item"], i["failures"][0]["calc"]) for i in result["issues"]] == [("ROLL 車修", "統計6 != 計算8")]
+
+
+def test_freight_uses_freight_factor_only():
+    result = run_accountant_checks(*fixture_page({"| 式 | 2 | 2 |": "| 式 | 4 | 4 |"}))
+    assert [(i["item"], i["failures"][0]["calc"]) for i in result["issues"]] == [("輥輪拆裝.車修或銲補運費", "統計4 != 計算2")]
+
+
+def pages_from_tables(*tables):
+    data = [{"page": n, "table": t, "header_text": "工令編號: 1130512-01"} for n, t in enumerate(tables, start=1)]
+    return parse_pages(data), data
+
+
+def detail_table(page, name, unit, qty, ids):
+    rows = "\n".join(f"| {a} | 296 | {b} | 297 |" for a, b in zip(ids[::2], ids[1::2]))
+    return f"### Table 1 (Page {page}):\n| 項次 | 品名 | 單位 | 數量 |\n| 1 | {name} | {unit} | {qty} |\n{rows}\n"
+
+
+ASSEMBLY = "W3 #1 機 300 輥輪 舊品拆裝 (PC)"
+BODY = "W3 #1 機 300 輥輪 本體未再生車修 (PC)"
+
+
+def test_assembly_count_mismatch_goes_to_residual():
+    ok = run_accountant_checks(*pages_from_tables(detail_table(1, ASSEMBLY, "PC", 2, ["Y0001", "Y0002"])))
+    assert ok["issues"] == [] and ok["residual"] == []
+    bad = run_accountant_checks(*pages_from_tables(detail_table(1, ASSEMBLY, "PC", 3, ["Y0001", "Y0002"])))
+    assert bad["issues"] == []
+    assert len(bad["residual"]) == 1 and "拆裝" in bad["residual"][0] and "資料筆數 2" in bad["residual"][0]
+
+
+def test_item_continued_across_pages():
+    # 續表每頁重複標示總數 4：共 4 支 -> 合格
+    repeated = pages_from_tables(detail_table(1, BODY, "PC", 4, ["Y0001", "Y0002"]),
+                                 detail_table(2, BODY, "PC", 4, ["Y0003", "Y0004"]))
+    assert run_accountant_checks(*repeated)["issues"] == []
+    # 各頁分別標示 2 + 3：共 4 支 -> 與加總 5 不符
+    split = pages_from_tables(detail_table(1, BODY, "PC", 2, ["Y0001", "Y0002"]),
+                              detail_table(2, BODY, "PC", 3, ["Y0003", "Y0004"]))
+    issues = run_accountant_checks(*split)["issues"]
+    assert [(i["item"], i["failures"][0]["calc"]) for i in issues] == [(BODY, "目標(P.1:2+P.2:3)x1=5 != 計算4")]
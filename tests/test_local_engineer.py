@@ -0,0 +1,57 @@
+import pytest
+
+from local_engineer import run_engineer_checks
+from table_parser import parse_pages
+
+ITEM = "W3 #1 機 300 輥輪 "
+BODY_PRE, BODY_WELD, BODY_FINISH = ITEM + "本體未再生車修 (PC)", ITEM + "本體銲補 (PC)", ITEM + "本體再生車修 (PC)"
+JOURNAL_PRE, JOURNAL_FINISH = ITEM + "軸頸未再生車修一端 (PC)", ITEM + "軸頸再生車修一端 (PC)"
+KEYWAY = ITEM + "KEYWAY 銑製 (PC)"
+
+
+def run(items):
+    """items: [(項目名稱, [(編號, 實測值), ...])]，全部放在第 1 頁同一張表"""
+    lines = ["### Table 1 (Page 1):", "| 項次 | 品名 | 單位 | 數量 |"]
+    for n, (name, entries) in enumerate(items, start=1):
+        lines.append(f"| {n} | {name} | PC | {len(entries)} |")
+        lines.extend(f"| {roll_id} | {raw} |" for roll_id, raw in entries)
+    data = [{"page": 1, "table": "\n".join(lines), "header_text": ""}]
+    return run_engineer_checks(parse_pages(data))
+
+
+def summary(result):
+    return sorted((i["common_reason"], f["id"]) for i in result["issues"] for f in i["failures"])
+
+
+CASES = [
+    ("整數未再生 -> 銲補 -> 再生車修 (正常流程)",
+     [(BODY_PRE, [("Y0001", "296")]), (BODY_WELD, [("Y0001", "305")]), (BODY_FINISH, [("Y0001", "300.02")])],
+     [], 0),
+    ("小數未再生 (已完工) 又進銲補",
+     [(BODY_PRE, [("Y0001", "296.5")]), (BODY_WELD, [("Y0001", "305")])],
+     [("已完工件重複加工", "Y0001")], 0),
+    ("整數未再生 (未完工) 缺再生車修",
+     [(BODY_PRE, [("Y0001", "296")]), (BODY_WELD, [("Y0001", "305")])],
+     [("未完工件中斷", "Y0001")], 0),
+    ("再生車修 >= 銲補",
+     [(BODY_PRE, [("Y0001", "296")]), (BODY_WELD, [("Y0001", "300")]), (BODY_FINISH, [("Y0001", "305.1")])],
+     [("違反製程大小順序", "Y0001")], 0),
+    ("銲補沒有未再生紀錄",
+     [(BODY_WELD, [("Y0001", "305")])],
+     [("無未再生紀錄(幽靈工件)", "Y0001")], 0),
+    ("KEYWAY 沒有軸位再生",
+     [(BODY_PRE, [("Y0001", "296.5")]), (KEYWAY, [("Y0001", "20")])],
+     [("缺軸位再生", "Y0001")], 0),
+    ("軸頸兩端數值無法配對 -> residual",
+     [(BODY_PRE, [("Y0001", "296.5")]),
+      (JOURNAL_PRE, [("Y0001", "126"), ("Y0001", "131")]), (JOURNAL_FINISH, [("Y0001", "130"), ("Y0001", "132")])],
+     [], 1),
+]
+
+
+@pytest.mark.parametrize("items,expected,residual", [c[1:] for c in CASES], ids=[c[0] for c in CASES])
+def test_engineer_rules(items, expected, residual):
+    result = run(items)
+    assert summary(result) == sorted(expected)
+    assert len(result["residual"]) == residual
+    assert all("多筆數值無法配對" in line for line in result["residual"])
@@ -0,0 +1,76 @@
+import io
+import json
+import os
+
+from PIL import Image, ImageDraw
+
+from page_dedup import _text_signature, find_candidates, find_duplicates, hamming, image_hash, text_similarity
+
+
+def render_form(roll_ids, values):
+    """同一張交貨單格式：格線、表頭一樣，只有編號與數值不同"""
+    image = Image.new("L", (1200, 1600), 255)
+    draw = ImageDraw.Draw(image)
+    draw.text((80, 60), "DELIVERY NOTE  W3-1234", fill=0)
+    for row in range(21):
+        draw.line((60, 150 + row * 60, 1140, 150 + row * 60), fill=0, width=3)
+    for x in (60, 400, 700, 1140):
+        draw.line((x, 150, x, 1350), fill=0, width=3)
+    for row, (roll_id, value) in enumerate(zip(roll_ids, values)):
+        draw.text((80, 170 + row * 60), roll_id, fill=0)
+        draw.text((420, 170 + row * 60), value, fill=0)
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=90)
+    return output.getvalue()
+
+
+def form_text(roll_ids, values):
+    return "DELIVERY NOTE W3-1234\n" + "\n".join(f"{r} | {v}" for r, v in zip(roll_ids, values))
+
+
+PAGE_A = ([f"Y{n:04d}" for n in range(100, 120)], [f"{250 + n * 0.13:.2f}" for n in range(20)])
+PAGE_B = ([f"Y{n:04d}" for n in range(200, 220)], [f"{180 + n * 0.37:.2f}" for n in range(20)])
+
+
+def test_same_layout_different_contents_is_only_a_candidate():
+    images = [render_form(*PAGE_A), render_form(*PAGE_B)]
+    hashes = [image_hash(b) for b in images]
+    assert hamming(*hashes) <= 10  # 影像雜湊分不出來
+
+    # OCR 前：不能排除 (要送 OCR)，只列為疑似
+    assert find_duplicates(hashes, [None, None], ["a", "b"]) == {}
+    assert find_candidates(hashes) == {1: 0}
+
+    # OCR 後：全文不同 -> 不是重複，也不再是疑似
+    texts = [form_text(*PAGE_A), form_text(*PAGE_B)]
+    assert find_duplicates(hashes, texts, ["a", "b"]) == {}
+    assert find_candidates(hashes, {}, texts) == {}
+
+
+def test_same_page_confirmed_by_text_or_bytes():
+    image = render_form(*PAGE_A)
+    hashes = [image_hash(image)] * 2
+    text = form_text(*PAGE_A)
+    assert find_duplicates(hashes, [text, text + " "], ["a", "b"]) == {1: (0, "影像+文字")}
+    assert find_duplicates(hashes, [None, None], ["a", "a"]) == {1: (0, "檔案")}
+
+
+def fixture_text():
+    path = os.path.join(os.path.dirname(__file__), os.pardir, "bench", "fixtures", "analyze_result_page.json")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["content"]
+
+
+def test_numbers_are_tokenized_on_raw_text():
+    numbers = _text_signature(fixture_text())[1]
+    assert "Y5612001" in numbers and "297.52" in numbers
+    assert not any(n.startswith("Y5612001") and n != "Y5612001" for n in numbers)  # 沒有 "Y5612001296" 這種黏在一起的
+
+
+def test_single_measured_value_difference_is_not_a_duplicate():
+    text = fixture_text()
+    reflowed = " ".join(text.split())  # 重拍時 OCR 的斷行/空白不同
+    changed = text.replace("297.52", "297.62")
+    assert text_similarity(text, reflowed) >= 0.85
+    assert text_similarity(text, changed) == 0.0
+    assert find_duplicates([None] * 3, [text, reflowed, changed]) == {1: (0, "文字")}
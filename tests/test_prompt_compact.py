@@ -0,0 +1,31 @@
+from prompt_compact import build_job_ir, serialize_for_agent
+
+DETAIL_WITH_PLAN_COLUMNS = """### Table 1 (Page 1):
+| 項次 | 品名 | 單位 | 預定數量 | 實交數量 |
+| 1 | W3 #1 機 300 輥輪 本體未再生車修 (SET) | SET | 1 | 1 |
+| Y5612001 | 296 | Y5612002 | 297.52 |  |
+"""
+
+SUMMARY = """### Table 1 (Page 1):
+| 項次 | 品名 | 單位 | 預定數量 | 實交數量 |
+| 1 | 輥輪拆裝.車修或銲補運費 | 式 | 2 | 2 |
+"""
+
+
+def job_ir(table_md):
+    return build_job_ir([{"page": 1, "table": table_md, "header_text": "工令編號: 1130512-01"}])
+
+
+def test_detail_table_with_plan_columns_reaches_engineer():
+    ir = job_ir(DETAIL_WITH_PLAN_COLUMNS)
+    assert ir[0]["tables"][0]["kind"] == "detail"
+    text, _ = serialize_for_agent(ir, "engineer")
+    assert "Y5612001|296|Y5612002|297.52" in text
+    assert "本體未再生車修" in text
+
+
+def test_summary_table_skipped_for_engineer_only():
+    ir = job_ir(SUMMARY)
+    assert ir[0]["tables"][0]["kind"] == "summary"
+    assert "運費" not in serialize_for_agent(ir, "engineer")[0]
+    assert "運費" in serialize_for_agent(ir, "accountant")[0]
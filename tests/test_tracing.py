@@ -0,0 +1,58 @@
+import concurrent.futures
+import json
+
+import pytest
+
+import tracing
+from tracing import bind, load_spans, percentile, span, summarize
+
+
+@pytest.mark.parametrize("values, q, expected", [
+    ([1, 2], 50, 1),                     # n=2 的 p50 是較小的那個
+    ([1, 2], 95, 2),
+    (list(range(1, 21)), 95, 19),        # 20 筆的 p95 = 第 19 小
+    (list(range(1, 21)), 50, 10),
+    (list(range(1, 101)), 95, 95),
+    ([7], 50, 7),
+    ([3, 1, 2], 100, 3),
+    ([3, 1, 2], 0, 1),
+])
+def test_percentile_nearest_rank(values, q, expected):
+    assert percentile(values, q) == expected
+
+
+def test_percentile_of_nothing_is_nan():
+    assert percentile([], 95) != percentile([], 95)
+
+
+def test_spans_nest_across_threads(trace_sink):
+    def call_gemini():
+        with span("gemini", model="models/flash"):
+            pass
+
+    with span(tracing.ROOT_SPAN, pages=2) as root:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(bind(call_gemini)).result()
+        with span("ocr", cache_hit=True):
+            pass
+        with pytest.raises(ValueError), span("agent.engineer"):
+            raise ValueError("boom")
+    records = {r["name"]: r for r in load_spans(trace_sink)}
+    assert records["ocr"]["parent_span_id"] == root.span_id
+    assert records["gemini"]["parent_span_id"] == root.span_id
+    assert records["agent.engineer"]["status"] == "error"
+    assert records[tracing.ROOT_SPAN]["parent_span_id"] is None
+    with open(trace_sink, encoding="utf-8") as f:
+        assert all(json.loads(line)["trace_id"] == root.trace_id for line in f)
+
+
+def test_summarize_uses_nearest_rank(trace_sink):
+    for ms in range(1, 21):
+        with span(tracing.ROOT_SPAN) as root:
+            pass
+        with open(trace_sink, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"name": "ocr", "trace_id": root.trace_id, "span_id": "x", "parent_span_id": root.span_id,
+                                "start_time_unix_nano": 0, "end_time_unix_nano": ms * 1_000_000,
+                                "attributes": {"cache_hit": ms % 2 == 0}, "status": "ok"}) + "\n")
+    row = next(r for r in summarize(load_spans(trace_sink)) if r["stage"] == "ocr")
+    assert (row["n"], row["p50_ms"], row["p95_ms"], row["cache_hit_rate"]) == (20, 10.0, 19.0, 0.5)
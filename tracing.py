@@ -0,0 +1,185 @@
+"""
+稽核流程的追蹤 (Span) 與效能統計
+
+畫面上的耗時只有 OCR / 工程師 / 會計師三個總數，不會保存，也看不出是哪一頁、哪一次呼叫慢。
+這裡提供很小的 Span 層 (不依賴 OpenTelemetry 套件)：
+- with span("gemini", model=...) as s: ...  s.set(prompt_tokens=...)
+- 以 contextvars 串起父子關係；丟進執行緒池的函數要先 bind() 才會掛在同一個 trace 下；
+- 每個結束的 Span 寫一行 JSON 到 TRACE_FILE (欄位名稱比照 OTLP：trace_id / span_id / parent_span_id /
+  start_time_unix_nano / end_time_unix_nano / attributes / status)，多個行程可以寫同一個檔；
+- summarize() 取最近 N 份工令 (根 Span = audit_job) 計算各階段 p50 / p95。
+    python tracing.py --jobs 50
+"""
+import argparse
+import contextlib
+import contextvars
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+TRACE_FILE = os.environ.get("TRACE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".traces", "spans.jsonl"))  # 空字串 = 不記錄
+TRACE_MAX_MB = int(os.environ.get("TRACE_MAX_MB", "50"))  # 超過就改名成 .1 (只保留一份舊檔)
+TRACE_SUMMARY_JOBS = 50
+TRACE_SUMMARY_MAX_MB = 20  # 統計只讀檔案最後這麼多
+ROOT_SPAN = "audit_job"
+
+_sink_path = TRACE_FILE or None
+_sink_lock = threading.Lock()
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = {}
+        self.status = "ok"
+        self.start = time.time_ns()
+        self.set(**attributes)
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def to_record(self, end):
+        return {
+            "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_span_id": self.parent_span_id,
+            "start_time_unix_nano": self.start, "end_time_unix_nano": end,
+            "attributes": self.attributes, "status": self.status,
+        }
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    current = Span(name, _current.get(), attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current.reset(token)
+        _export(current.to_record(time.time_ns()))
+
+
+def set_attributes(**attributes):
+    """加在目前的 Span 上 (沒有進行中的 Span 就忽略)"""
+    current = _current.get()
+    if current is not None: current.set(**attributes)
+
+
+def bind(func):
+    """執行緒池不會帶 contextvars 過去：先記下目前的 Span，在工作執行緒裡當作父 Span"""
+    parent = _current.get()
+    def bound(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return bound
+
+
+def set_sink(path):
+    """改寫入位置；None 關閉記錄 (基準測試用)"""
+    global _sink_path
+    with _sink_lock: _sink_path = path
+
+
+def _export(record):
+    with _sink_lock:
+        path = _sink_path
+        if not path: return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) > TRACE_MAX_MB * 1024 * 1024:
+                os.replace(path, path + ".1")
+            # 一行一次 write (append 模式)，多個行程同時寫也不會交錯
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except OSError:
+            pass  # 追蹤失敗不能影響稽核
+
+
+def load_spans(path=None):
+    path = path or _sink_path
+    if not path or not os.path.exists(path): return []
+    with open(path, "rb") as f:
+        f.seek(max(0, os.path.getsize(path) - TRACE_SUMMARY_MAX_MB * 1024 * 1024))
+        data = f.read()
+    spans = []
+    for line in data.decode("utf-8", errors="ignore").splitlines():
+        try:
+            spans.append(json.loads(line))
+        except ValueError:
+            continue  # 截斷處或寫到一半的行
+    return spans
+
+
+def percentile(values, q):
+    """最近排名法 (nearest-rank)：第 ceil(q% x n) 小的值；基準測試也用這個"""
+    if not values: return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered) / 100) - 1)]
+
+
+def stage_name(record):
+    # Gemini 依模型分開統計 (Flash / Pro 延遲差很多)
+    model = record["attributes"].get("model")
+    return f"{record['name']}[{model.rsplit('/', 1)[-1]}]" if model else record["name"]
+
+
+def summarize(spans=None, last_jobs=TRACE_SUMMARY_JOBS):
+    """
+    最近 last_jobs 份工令的各階段統計：
+    [{"stage", "n", "p50_ms", "p95_ms", "cache_hit_rate", "errors"}, ...] (依 p95 由大到小)
+    """
+    spans = load_spans() if spans is None else spans
+    roots = sorted((s for s in spans if s["name"] == ROOT_SPAN), key=lambda s: s["start_time_unix_nano"])[-last_jobs:]
+    traces = {s["trace_id"] for s in roots}
+    durations, hits, errors = defaultdict(list), defaultdict(list), defaultdict(int)
+    for s in spans:
+        if s["trace_id"] not in traces: continue
+        stage = stage_name(s)
+        durations[stage].append((s["end_time_unix_nano"] - s["start_time_unix_nano"]) / 1e6)
+        if "cache_hit" in s["attributes"]: hits[stage].append(bool(s["attributes"]["cache_hit"]))
+        if s["status"] != "ok": errors[stage] += 1
+    rows = [{
+        "stage": stage, "n": len(values),
+        "p50_ms": round(percentile(values, 50), 1), "p95_ms": round(percentile(values, 95), 1),
+        "cache_hit_rate": round(sum(hits[stage]) / len(hits[stage]), 3) if hits[stage] else None,
+        "errors": errors[stage],
+    } for stage, values in durations.items()]
+    return sorted(rows, key=lambda r: -r["p95_ms"])
+
+
+def format_summary(rows, out=sys.stdout):
+    print(f"{'階段':<28}{'次數':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'快取命中':>9}{'錯誤':>6}", file=out)
+    for r in rows:
+        hit = f"{r['cache_hit_rate']:.0%}" if r["cache_hit_rate"] is not None else "-"
+        print(f"{r['stage']:<28}{r['n']:>6}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{hit:>9}{r['errors']:>6}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="各階段 p50 / p95 (讀取追蹤檔)")
+    parser.add_argument("--file", default=TRACE_FILE, help="Span JSONL 路徑")
+    parser.add_argument("--jobs", type=int, default=TRACE_SUMMARY_JOBS, help="只看最近幾份工令")
+    args = parser.parse_args(argv)
+    rows = summarize(load_spans(args.file), args.jobs)
+    if not rows:
+        print("沒有追蹤資料", file=sys.stderr)
+        return 1
+    format_summary(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())